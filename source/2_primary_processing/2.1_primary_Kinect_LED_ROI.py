@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 import sys
+import tempfile
 
 # homemade libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
@@ -18,6 +19,13 @@ if __name__ == "__main__":
     force_processing = False  # If user wants to force data processing even if results already exist
     load_led_location = False  # If user wants to load already defined LED location if it already exists
     show = False  # If user wants to monitor what's happening
+    # If user wants to store the extracted LED area in a temporary file on disk (memmap, removed once the results
+    # are saved) instead of RAM: only then the memory used stays flat, in RAM the area grows with the video length
+    roi_on_disk = True
+    ffmpeg_crop = True  # If user wants ffmpeg to crop the LED area while decoding (only used for mkv)
+    save_roi_video = True  # False if the LED blinking is extracted in one pass from the source video (2.2, single_pass)
+    roi_format = "mp4"  # "mp4" (lossy video) or "npy" (lossless .npy chunks, read faster by 2.2)
+    write_roi_while_extracting = True  # If user wants the ROI to be saved by a writer thread during the decoding
 
     save_results = True
 
@@ -153,20 +161,42 @@ if __name__ == "__main__":
                 continue
 
 
-            if led_in_frames[idx]:
-                # if the video hasn't been processed yet or redo the processing (load results = False)
-                led_roi.led_in_frame = led_in_frames[idx]
-                led_roi.initialise_video()
-                led_roi.set_reference_frame(frame_idx[idx])
-                led_roi.select_led_location(square_center[idx], square_radius[idx])
-                led_roi.extract_roi()
-            else:
-                led_roi.initialise_video()
-                led_roi.extract_metadata_video()
-                print(f"LED is not in frame, extract and save metadata only.")
-
-            if save_results:
-                led_roi.save_results(verbose=True)
+            memmap_dirname = None
+            memmap_filename = None
+            try:
+                if led_in_frames[idx]:
+                    # if the video hasn't been processed yet or redo the processing (load results = False)
+                    led_roi.led_in_frame = led_in_frames[idx]
+                    led_roi.initialise_video()
+                    led_roi.set_reference_frame(frame_idx[idx])
+                    led_roi.select_led_location(square_center[idx], square_radius[idx])
+                    if roi_on_disk and save_roi_video:
+                        # scratch file, not one of the results
+                        memmap_dirname = tempfile.mkdtemp(prefix="kinect_led_roi_")
+                        memmap_filename = os.path.join(memmap_dirname, output_filename + "_roi.dat")
+                    # the ROI is written during the extraction only if the results are saved
+                    roi_writing_format = roi_format if (save_results and write_roi_while_extracting) else None
+                    if not save_roi_video:
+                        print(f"LED location only, the ROI video is not created.")
+                    elif "mp4" in extension:
+                        led_roi.extract_roi(memmap_filename=memmap_filename, roi_format=roi_writing_format)
+                    else:
+                        led_roi.extract_roi(memmap_filename=memmap_filename, ffmpeg_crop=ffmpeg_crop,
+                                            roi_format=roi_writing_format)
+                else:
+                    led_roi.initialise_video()
+                    led_roi.extract_metadata_video()
+                    print(f"LED is not in frame, extract and save metadata only.")
+
+                if save_results:
+                    led_roi.save_results(verbose=True, save_video=save_roi_video, roi_format=roi_format)
+            finally:
+                if memmap_dirname is not None:
+                    # the memmap is released before removing its file (required on Windows)
+                    led_roi.roi = None
+                    if os.path.exists(memmap_filename):
+                        os.remove(memmap_filename)
+                    os.rmdir(memmap_dirname)
 
         if save_results:
             p = db_path_output.replace("\\", "/")
@@ -2,12 +2,13 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import pandas as pd
 import sys
 
 # homemade libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from libraries.primary.semicontrolled_Kinect_led_blinking import KinectLEDBlinking  # noqa: E402
-from libraries.primary.semicontrolled_Kinect_led_blinking_mp4 import KinectLEDBlinkingMP4  # noqa: E402
+from libraries.primary.semicontrolled_Kinect_led_blinking_batch import (create_led_blinking_job,  # noqa: E402
+                                                                        run_led_blinking_batch)
 import libraries.misc.path_tools as path_tools  # noqa: E402
 from libraries.misc.waitforbuttonpress_popup import WaitForButtonPressPopup
 
@@ -45,6 +46,8 @@ def find_metadata_files(input_path, sessions):
 
 if __name__ == "__main__":
     use_mp4 = True
+    single_pass = False  # If user wants to extract the blinking directly from the source video (no ROI video needed)
+    n_workers = None  # Number of videos processed in parallel (None: all the cores, 1: one after the other)
 
     force_processing = True  # If user wants to force data processing even if results already exist
     show_video_by_frames = False  # If user wants to monitor what's happening
@@ -96,55 +99,47 @@ if __name__ == "__main__":
     sessions = sessions + sessions_ST16
     sessions = sessions + sessions_ST18
 
+    jobs = []
     for session in sessions:
         md_files_abs, md_files, _ = find_metadata_files(db_path_input, session)
 
         # Process LED blinking
         for idx, (md_filename_abs, md_filename) in enumerate(zip(md_files_abs, md_files)):
-            print(f"File '{md_filename}'")
-
             # output directory
             output_dirname = os.path.join(db_path_output, session)
             if not os.path.exists(output_dirname):
                 os.makedirs(output_dirname)
 
-            # create video filename from metadata filename
-            video_filename_abs = md_filename_abs.replace("_metadata.txt", ".mp4")
+            # create video filename from metadata filename (the lossless .npy chunks are used if they exist)
+            video_filename_abs = md_filename_abs.replace("_metadata.txt", "_npy")
+            if not os.path.isdir(video_filename_abs):
+                video_filename_abs = md_filename_abs.replace("_metadata.txt", ".mp4")
 
             # create output filename from metadata filename
             output_filename = md_filename.replace("_kinect_LED_roi_metadata.txt", "_LED")
 
-            # create Kinect processing manager
-            if "mp4" in extension:
-                led_blink = KinectLEDBlinkingMP4(video_filename_abs, output_dirname, output_filename)
-            else:
-                led_blink = KinectLEDBlinking(video_filename_abs, output_dirname, output_filename)
-
-            if led_blink.is_already_processed() and not force_processing:
+            jobs.append(create_led_blinking_job(md_filename_abs, video_filename_abs, output_dirname, output_filename,
+                                                use_mp4="mp4" in extension, single_pass=single_pass,
+                                                force_processing=force_processing, save_results=save_results,
+                                                threshold=.20, occlusion_threshold=40))
+
+    # videos are processed in parallel, unless the user wants to monitor what's happening
+    if show_video_by_frames:
+        n_workers = 1
+    summary_filename_abs = os.path.join(db_path_output, "LED_blinking_processing_summary.csv")
+    summary = run_led_blinking_batch(jobs, n_workers=n_workers, summary_filename_abs=summary_filename_abs,
+                                     show=show_video_by_frames)
+
+    if show_results and save_results:
+        for job, status in zip(jobs, summary["status"]):
+            if status != "processed":
                 continue
-
-            # Check if the video exists
-            if not os.path.exists(video_filename_abs):
-                print(f"The video_path does not point on an existing file. Creating a phantom result file...")
-                led_blink.create_phantom_result_file(md_filename_abs)
-            else:
-                # if the video hasn't been processed yet or redo the processing (load results = False)
-                led_blink.load_video()
-
-                led_blink.monitor_green_levels(show=show_video_by_frames)
-                led_blink.process_led_on(threshold=.20)
-                # correct for any occlusion
-                led_blink.define_occlusion(threshold=40, show=show_video_by_frames)
-
-            if save_results:
-                led_blink.save_results()
-
-            if show_results:
-                plt.plot(led_blink.time, led_blink.led_on)
-                plt.ion()
-                plt.show()
-                WaitForButtonPressPopup()
-                plt.close()
+            df = pd.read_csv(os.path.join(job["output_dirname"], job["output_filename"] + ".csv"))
+            plt.plot(df["time (second)"], df["LED on"])
+            plt.ion()
+            plt.show()
+            WaitForButtonPressPopup()
+            plt.close()
 
     if save_results:
         p = db_path_output.replace("\\", "/")
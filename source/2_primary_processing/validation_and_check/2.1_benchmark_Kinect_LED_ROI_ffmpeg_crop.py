@@ -0,0 +1,68 @@
+import numpy as np
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+# homemade libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from libraries.primary.semicontrolled_Kinect_ffmpeg import (get_square_region, get_rawvideo_cmd,  # noqa: E402
+                                                            get_rawvideo_frame_shape)
+
+
+def create_synthetic_video(video_path, frame_width=1920, frame_height=1080, fps=30, duration=20):
+    # moving test pattern encoded the same way as the Kinect colour stream (yuv420p)
+    cmd = ["ffmpeg", "-y", "-v", "quiet",
+           "-f", "lavfi", "-i", f"testsrc2=size={frame_width}x{frame_height}:rate={fps}:duration={duration}",
+           "-c:v", "libx264", "-pix_fmt", "yuv420p", video_path]
+    subprocess.run(cmd, check=True)
+
+
+def read_roi(video_path, frame_width, frame_height, region, ffmpeg_crop):
+    crop_region = region if ffmpeg_crop else None
+    cmd = get_rawvideo_cmd(video_path, 0, crop_region=crop_region)
+    cmd[1:1] = ["-v", "quiet"]
+    frame_shape = get_rawvideo_frame_shape(frame_width, frame_height, crop_region=crop_region)
+    nelem = frame_shape.prod()
+    x_start, x_end, y_start, y_end = region
+
+    roi = []
+    nbytes = 0
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        while True:
+            data = proc.stdout.read(nelem)
+            if not data:
+                break
+            nbytes += len(data)
+            frame = np.frombuffer(data, dtype=np.uint8).reshape(frame_shape)
+            if ffmpeg_crop:
+                roi.append(frame)
+            else:
+                roi.append(frame[y_start:y_end, x_start:x_end])
+    return np.array(roi), nbytes
+
+
+if __name__ == "__main__":
+    frame_width, frame_height = 1920, 1080
+    # typical LED square, with odd coordinates to check that the crop is pixel exact
+    square_center = (1501, 233)
+    square_size = 31
+    region = get_square_region(square_center, square_size, frame_width, frame_height)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, "synthetic_kinect.mkv")
+        print("Create synthetic video...")
+        create_synthetic_video(video_path, frame_width, frame_height)
+
+        results = {}
+        for ffmpeg_crop in [False, True]:
+            start_time = timeit.default_timer()
+            roi, nbytes = read_roi(video_path, frame_width, frame_height, region, ffmpeg_crop)
+            elapsed_time = timeit.default_timer() - start_time
+            results[ffmpeg_crop] = roi
+            label = "ffmpeg crop" if ffmpeg_crop else "NumPy crop "
+            print(f"{label}: {elapsed_time:.3f} seconds, {nbytes / 1e6:.1f} MB piped, roi shape = {roi.shape}")
+
+    identical = results[False].shape == results[True].shape and np.array_equal(results[False], results[True])
+    print(f"Identical area of interest: {identical}")
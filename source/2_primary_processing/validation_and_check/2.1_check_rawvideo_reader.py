@@ -0,0 +1,148 @@
+import io
+import numpy as np
+import os
+import sys
+import threading
+import timeit
+import warnings
+
+# homemade libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from libraries.primary.semicontrolled_Kinect_ffmpeg import (readinto_full, read_rawvideo_frames,  # noqa: E402
+                                                            read_rawvideo_stream)
+
+
+class ChunkedRawStream(io.RawIOBase):
+    # Fake pipe: returns the data by pieces of random sizes (at most max_chunk bytes per read), as a pipe
+    # returns what ffmpeg has written so far
+    def __init__(self, data, max_chunk, rng):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.max_chunk = max_chunk
+        self.rng = rng
+        self.nreads = 0
+        self.nshort_reads = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), len(self.data) - self.pos, int(self.rng.integers(1, self.max_chunk + 1)))
+        buffer[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        self.nreads += 1
+        if 0 < n < len(buffer):
+            self.nshort_reads += 1
+        return n
+
+
+def create_frames(nframes, frame_shape, rng):
+    return rng.integers(0, 256, size=(nframes, *frame_shape), dtype=np.uint8)
+
+
+# child process standing for ffmpeg: writes frames (frame idx % 256 in every byte) until the pipe is closed
+WRITER_CODE = """
+import os
+frame_size = {frame_size}
+idx = 0
+try:
+    while True:
+        frame = memoryview(bytes([idx % 256]) * frame_size)
+        while len(frame):
+            frame = frame[os.write(1, frame):]
+        idx += 1
+except BrokenPipeError:
+    pass
+"""
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    failures = 0
+
+    # short reads: frames read through the fake pipe, directly or through a BufferedReader (as Popen's stdout)
+    for frame_shape in [(20, 20, 3), (37, 53, 3), (360, 640, 3)]:
+        frames = create_frames(25, frame_shape, rng)
+        for nbuffers in (1, 3):
+            for buffered in (False, True):
+                raw = ChunkedRawStream(frames.tobytes(), max_chunk=4096, rng=rng)
+                stream = io.BufferedReader(raw, buffer_size=1024) if buffered else raw
+                frames_read = [frame.copy() for frame in read_rawvideo_stream(stream, frame_shape, nbuffers)]
+                if len(frames_read) != len(frames) or not np.array_equal(np.array(frames_read), frames):
+                    print(f"FAILED: short reads, frame shape {frame_shape}, nbuffers {nbuffers}, "
+                          f"buffered {buffered}: {len(frames_read)} frames read")
+                    failures += 1
+                if not raw.nshort_reads:
+                    print(f"FAILED: the fake pipe didn't return short reads ({frame_shape})")
+                    failures += 1
+
+    # readinto_full: fills the whole buffer from short reads, and less only at the end of the stream
+    data = bytes(range(250)) * 6
+    raw = ChunkedRawStream(data, max_chunk=7, rng=rng)
+    buffer = bytearray(1000)
+    if readinto_full(raw, memoryview(buffer)) != 1000 or buffer != data[:1000]:
+        print("FAILED: readinto_full didn't fill the buffer")
+        failures += 1
+    if readinto_full(raw, memoryview(buffer)) != len(data) - 1000 or buffer[:500] != data[1000:]:
+        print("FAILED: readinto_full at the end of the stream")
+        failures += 1
+
+    # the ring of buffers: a yielded frame is overwritten nbuffers frames later
+    frame_shape = (4, 4, 3)
+    frames = create_frames(6, frame_shape, rng)
+    frames_read = list(read_rawvideo_stream(ChunkedRawStream(frames.tobytes(), 10, rng), frame_shape, nbuffers=3))
+    if not (np.shares_memory(frames_read[0], frames_read[3]) and not np.shares_memory(frames_read[0], frames_read[1])
+            and np.array_equal(np.array(frames_read[3:]), frames[3:])):
+        print("FAILED: ring of buffers")
+        failures += 1
+
+    # incomplete last frame: dropped with a warning
+    frame_shape = (30, 40, 3)
+    frames = create_frames(5, frame_shape, rng)
+    data = frames.tobytes() + frames[0].tobytes()[:1234]
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        frames_read = [frame.copy() for frame in
+                       read_rawvideo_stream(ChunkedRawStream(data, 500, rng), frame_shape)]
+    if len(frames_read) != len(frames) or not np.array_equal(np.array(frames_read), frames):
+        print(f"FAILED: incomplete last frame, {len(frames_read)} frames read instead of {len(frames)}")
+        failures += 1
+    if not any("Incomplete last frame (1234 bytes" in str(w.message) for w in caught):
+        print("FAILED: no warning for the incomplete last frame")
+        failures += 1
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        list(read_rawvideo_stream(ChunkedRawStream(frames.tobytes(), 500, rng), frame_shape))
+    if caught:
+        print("FAILED: warning without incomplete frame")
+        failures += 1
+
+    # consumer stopping early while the writer is still writing (endless stream): the generator closes the pipe
+    # and returns, the writer stops on its next write instead of blocking the consumer
+    frame_shape = (120, 160, 3)
+    cmd = [sys.executable, "-c", WRITER_CODE.format(frame_size=int(np.prod(frame_shape)))]
+    frames_read = []
+    closed = threading.Event()
+
+    def consume():
+        frames = read_rawvideo_frames(cmd, frame_shape)
+        for frame in frames:
+            frames_read.append(int(frame[0, 0, 0]))
+            if len(frames_read) == 10:
+                break
+        frames.close()
+        closed.set()
+
+    t = timeit.default_timer()
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    if not closed.wait(timeout=30):
+        print("FAILED: the reader is blocked after the consumer stopped")
+        failures += 1
+    elif frames_read != list(range(10)):
+        print(f"FAILED: early stop, frames {frames_read}")
+        failures += 1
+    else:
+        print(f"early stop: reader closed in {timeit.default_timer() - t:.3f} s")
+
+    print("OK" if not failures else f"{failures} FAILED")
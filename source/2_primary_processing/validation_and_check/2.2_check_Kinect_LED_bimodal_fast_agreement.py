@@ -0,0 +1,63 @@
+import numpy as np
+import os
+import pandas as pd
+import sys
+import timeit
+
+# homemade libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from libraries.primary.semicontrolled_Kinect_led_blinking import KinectLEDBlinking  # noqa: E402
+import libraries.misc.path_tools as path_tools  # noqa: E402
+
+
+if __name__ == "__main__":
+    # Compare the LED on vector of the full gaussian mixture fit ("bimodal")
+    # with the subsampled fit + threshold ("bimodal_fast") on the existing results of 2.2.
+    save_results = True
+
+    db_path = os.path.join(path_tools.get_database_path(), "semi-controlled")
+    db_path_input = os.path.join(db_path, "2_processed", "kinect", "led", "0_block-order")
+    files_abs, files = path_tools.find_files_in_directory(db_path_input, ending='_LED.csv')
+
+    rows = []
+    for file_abs, file in zip(files_abs, files):
+        df = pd.read_csv(file_abs)
+        green_levels = df["green level"].values
+        # phantom result files (LED out of frame) only contain NaN values
+        if np.all(np.isnan(green_levels)):
+            continue
+
+        led_blink_full = KinectLEDBlinking("", "", "")
+        led_blink_full.green_levels = green_levels.copy()
+        led_blink_full.nframes = len(green_levels)
+        start_time = timeit.default_timer()
+        led_blink_full.process_led_on(method="bimodal")
+        elapsed_full = timeit.default_timer() - start_time
+
+        led_blink_fast = KinectLEDBlinking("", "", "")
+        led_blink_fast.green_levels = green_levels.copy()
+        led_blink_fast.nframes = len(green_levels)
+        start_time = timeit.default_timer()
+        led_blink_fast.process_led_on(method="bimodal_fast")
+        elapsed_fast = timeit.default_timer() - start_time
+
+        agreement = np.mean(np.asarray(led_blink_full.led_on) == np.asarray(led_blink_fast.led_on))
+        print(f"{file}: agreement = {100 * agreement:.3f} %, "
+              f"time full = {elapsed_full:.3f} s, time fast = {elapsed_fast:.3f} s")
+        rows.append({
+            "file": file,
+            "nframes": len(green_levels),
+            "agreement": agreement,
+            "threshold_fast": led_blink_fast.threshold_value,
+            "elapsed_time_full (second)": elapsed_full,
+            "elapsed_time_fast (second)": elapsed_fast
+        })
+
+    df_summary = pd.DataFrame(rows)
+    if len(df_summary):
+        print(f"Median agreement = {100 * df_summary['agreement'].median():.3f} %, "
+              f"min agreement = {100 * df_summary['agreement'].min():.3f} %")
+        print(f"Total time full = {df_summary['elapsed_time_full (second)'].sum():.1f} s, "
+              f"total time fast = {df_summary['elapsed_time_fast (second)'].sum():.1f} s")
+    if save_results:
+        df_summary.to_csv(os.path.join(db_path_input, "LED_on_bimodal_fast_agreement.csv"), index=False)
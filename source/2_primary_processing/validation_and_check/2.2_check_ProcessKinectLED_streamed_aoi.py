@@ -0,0 +1,132 @@
+import cv2
+import numpy as np
+import os
+import sys
+import tempfile
+
+# homemade libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from libraries.processing.semicontrolled_Kinect_manager import ProcessKinectLED  # noqa: E402
+from libraries.processing.semicontrolled_data_cleaning import normalize_signal  # noqa: E402
+
+
+def create_blinking_led_video(video_path, nframes=300, frame_width=640, frame_height=360,
+                              square_center=(200, 150), square_size=40, fps=30):
+    # Video of a green LED blinking in front of a noisy background, with a hand occluding it for a few frames
+    rng = np.random.default_rng(0)
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (frame_width, frame_height))
+    half_size = square_size // 2
+    x, y = square_center
+    for idx in range(nframes):
+        frame = rng.integers(0, 60, size=(frame_height, frame_width, 3), dtype=np.uint8)
+        if (idx // 15) % 2:
+            frame[y - half_size // 2:y + half_size // 2, x - half_size // 2:x + half_size // 2] = (40, 220, 40)
+        if 200 <= idx < 210:
+            frame[y - half_size:y + half_size, x - half_size:x + half_size] = (180, 170, 160)
+        writer.write(frame)
+    writer.release()
+
+
+def process_with_cv2(video_path, square_center, square_size, lower_green, upper_green, threshold, occlusion_threshold):
+    # former implementation: cv2.VideoCapture, the whole AOI stack in memory, frame by frame green levels and
+    # pixel-wise average LED OFF/ON frames
+    cap = cv2.VideoCapture(video_path)
+    half_size = square_size // 2
+    aoi = []
+    while cap.isOpened():
+        correctly_read, frame = cap.read()
+        if not correctly_read:
+            break
+        x_start = max(square_center[0] - half_size, 0)
+        x_end = min(square_center[0] + half_size, frame.shape[1])
+        y_start = max(square_center[1] - half_size, 0)
+        y_end = min(square_center[1] + half_size, frame.shape[0])
+        aoi.append(frame[y_start:y_end, x_start:x_end])
+    cap.release()
+    aoi = np.array(aoi)
+
+    green_levels = np.zeros(len(aoi))
+    for idx, frame in enumerate(aoi):
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, lower_green, upper_green)
+        green_levels[idx] = np.mean(cv2.bitwise_and(frame, frame, mask=mask)[:, :, 1])
+    green_levels = normalize_signal(green_levels, dtype=np.ndarray)
+
+    led_on = np.zeros(len(aoi))
+    led_on[green_levels > threshold] = 1
+
+    frame_avg_off = np.round(np.mean(aoi[led_on == 0], axis=0)).astype(int)
+    frame_avg_on = np.round(np.mean(aoi[led_on == 1], axis=0)).astype(int)
+    occluded = np.full(len(aoi), False, dtype=bool)
+    for idx, frame in enumerate(aoi):
+        mean_off = abs(np.mean(np.subtract(frame, frame_avg_off)))
+        mean_on = abs(np.mean(np.subtract(frame, frame_avg_on)))
+        if not (mean_off < occlusion_threshold) or not (mean_on < occlusion_threshold):
+            occluded[idx] = True
+    # the LED state of the occluded frames is unknown
+    led_on[occluded] = np.nan
+    return green_levels, led_on, occluded
+
+
+def process_with_manager(video_path, square_center, square_size, threshold, occlusion_threshold, keep_aoi):
+    led = ProcessKinectLED(video_path, "", "")
+    led.initialise_video()
+    led.define_reference_frame(0)
+    led.select_led_location(square_center, square_size)
+    led.extract_aoi(keep_aoi=keep_aoi, chunk_size=64)
+    led.monitor_green_levels()
+    led.process_led_on(threshold=threshold)
+    led.define_occlusion(threshold=occlusion_threshold)
+    return led
+
+
+if __name__ == "__main__":
+    # Compare the streamed ffmpeg decoding of ProcessKinectLED.extract_aoi (default: the AOI is not kept)
+    # with the former cv2 path, on the video given as argument (video_path center_x center_y square_size)
+    # or on a generated video of a blinking LED.
+    threshold = 0.25
+    occlusion_threshold = 40
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(sys.argv) > 1:
+            video_path = sys.argv[1]
+            square_center = (int(sys.argv[2]), int(sys.argv[3]))
+            square_size = int(sys.argv[4])
+        else:
+            video_path = os.path.join(tmp_dir, "blinking_led.avi")
+            square_center = (200, 150)
+            square_size = 40
+            create_blinking_led_video(video_path, square_center=square_center, square_size=square_size)
+
+        led_ref = ProcessKinectLED(video_path, "", "")
+        green_levels, led_on, occluded = process_with_cv2(video_path, square_center, square_size,
+                                                          led_ref.lower_green, led_ref.upper_green,
+                                                          threshold, occlusion_threshold)
+
+        failures = 0
+        for keep_aoi in (False, True):
+            led = process_with_manager(video_path, square_center, square_size, threshold, occlusion_threshold,
+                                       keep_aoi)
+            if (led.aoi is not None) != keep_aoi:
+                print(f"FAILED (keep_aoi={keep_aoi}): the AOI is {'not ' if keep_aoi else ''}kept")
+                failures += 1
+            if led.nframes != len(green_levels):
+                print(f"FAILED (keep_aoi={keep_aoi}): {led.nframes} frames instead of {len(green_levels)}")
+                failures += 1
+                continue
+            if not np.allclose(led.green_levels, green_levels):
+                print(f"FAILED (keep_aoi={keep_aoi}): green levels, max difference "
+                      f"{np.max(np.abs(led.green_levels - green_levels))}")
+                failures += 1
+            if not np.array_equal(np.asarray(led.led_on, dtype=float), led_on, equal_nan=True):
+                print(f"FAILED (keep_aoi={keep_aoi}): LED on")
+                failures += 1
+            # the estimation from the frame sums (AOI not kept) has no pixel-wise rounding of the average
+            # frames: the distances differ by less than 0.5, only frames at the threshold can differ
+            if not np.array_equal(np.asarray(led.occluded, dtype=bool), occluded):
+                print(f"FAILED (keep_aoi={keep_aoi}): occlusion, {np.count_nonzero(led.occluded != occluded)} "
+                      f"frames differ")
+                failures += 1
+        print(f"{len(green_levels)} frames, {np.count_nonzero(led_on == 1)} LED on, "
+              f"{np.count_nonzero(occluded)} occluded")
+        print("OK" if not failures else f"{failures} FAILED")
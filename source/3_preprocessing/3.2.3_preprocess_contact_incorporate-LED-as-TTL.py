@@ -9,6 +9,7 @@ import matplotlib.pyplot as plt
 # homemade libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import libraries.misc.path_tools as path_tools  # noqa: E402
+from libraries.materials.kinect_led import read_led_timeseries  # noqa: E402
 
 
 if __name__ == "__main__":
@@ -98,7 +99,8 @@ if __name__ == "__main__":
                     pass
 
             contact = pd.read_csv(file_contact_abs)
-            led = pd.read_csv(file_led_abs)
+            # the npz copy of the LED csv file is read if it is available
+            led = read_led_timeseries(file_led_abs)
 
             # check if the two datasets are somewhat similar
             nframe_contact = len(contact)
@@ -11,31 +11,45 @@ import warnings
 # homemade libraries
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import libraries.misc.path_tools as path_tools  # noqa: E402
+from libraries.processing.semicontrolled_signal_lag import estimate_lag  # noqa: E402
 
 
-def get_correlation(sig1, sig2, downsampling=0.1, show=False):
-    if downsampling < 0 or downsampling > 1:
+def get_correlation(sig1, sig2, downsampling=None, coarse_factor=None, show=False):
+    # By default, the lag is estimated at full rate by FFT cross-correlation with a sub-sample (parabolic)
+    # refinement of the peak, then rounded to the nearest sample. coarse_factor (e.g. 10) searches the lag on
+    # block-averaged signals first, then refines it at full rate around the coarse estimation.
+    # downsampling (legacy, e.g. 0.1) picks a ratio of the samples before the correlation instead,
+    # which limits the precision to 1/downsampling samples and can miss short TTL pulses.
+    if downsampling is not None and (downsampling <= 0 or downsampling > 1):
         warnings.warn("downsampling has to be a float between 0 and 1.")
         return
 
-    # just in case, remove temporarily any nan value for correlation
-    # for some reason, np.nan_to_num doesn't work.
-    with pd.option_context('future.no_silent_downcasting', True):
-        sig1 = pd.Series(sig1).fillna(0).values
-        sig2 = pd.Series(sig2).fillna(0).values
-
-    # signals can be downsampled for a faster correlation
-    sig1_corr = sig1[np.linspace(0, len(sig1) - 1, int(downsampling * len(sig1)), dtype=int)]
-    sig2_corr = sig2[np.linspace(0, len(sig2) - 1, int(downsampling * len(sig2)), dtype=int)]
-
-    # remove the mean for a better estimation of the correlation
-    sig1_corr = sig1_corr - np.mean(sig1_corr)
-    sig2_corr = sig2_corr - np.mean(sig2_corr)
-
-    # lag estimation
-    correlation = signal.correlate(sig1_corr, sig2_corr, mode="full")
-    lags = signal.correlation_lags(sig1_corr.size, sig2_corr.size, mode="full")
-    lag = int(lags[np.argmax(correlation)] / downsampling)
+    # the scaled kinect columns have an object dtype
+    sig1 = np.asarray(sig1, dtype=float)
+    sig2 = np.asarray(sig2, dtype=float)
+
+    if downsampling is None:
+        # nan values and the mean are removed by estimate_lag
+        sig1_corr = sig1
+        sig2_corr = sig2
+        lag = int(np.round(estimate_lag(sig1, sig2, subsample=True, coarse_factor=coarse_factor)))
+    else:
+        # just in case, remove temporarily any nan value for correlation
+        sig1 = np.nan_to_num(sig1)
+        sig2 = np.nan_to_num(sig2)
+
+        # signals can be downsampled for a faster correlation
+        sig1_corr = sig1[np.linspace(0, len(sig1) - 1, int(downsampling * len(sig1)), dtype=int)]
+        sig2_corr = sig2[np.linspace(0, len(sig2) - 1, int(downsampling * len(sig2)), dtype=int)]
+
+        # remove the mean for a better estimation of the correlation
+        sig1_corr = sig1_corr - np.mean(sig1_corr)
+        sig2_corr = sig2_corr - np.mean(sig2_corr)
+
+        # lag estimation
+        correlation = signal.correlate(sig1_corr, sig2_corr, mode="full")
+        lags = signal.correlation_lags(sig1_corr.size, sig2_corr.size, mode="full")
+        lag = int(lags[np.argmax(correlation)] / downsampling)
 
     if show:
         if len(sig1_corr) > len(sig2_corr):
@@ -76,6 +90,7 @@ if __name__ == "__main__":
     force_processing = True  # If user wants to force data processing even if results already exist
     show = False  # If user wants to monitor what's happening
     scaling_nofilling = True
+    lag_coarse_factor = 30  # Lag searched coarse to fine (block-averaged by 30, then full rate); None: full rate FFT
 
     generate_report = True
     save_results = True
@@ -188,7 +203,7 @@ if __name__ == "__main__":
             # 1. synchronise kinect and nerve data using TTL signal (nerve_Volt + kinect_LED)
             TTL_kinect = kinect_scaled["LED on"].values
             TTL_nerve = nerve["TTL_Aut"].values
-            lag = get_correlation(TTL_kinect, TTL_nerve, downsampling=0.1)
+            lag = get_correlation(TTL_kinect, TTL_nerve, coarse_factor=lag_coarse_factor)
             print(f"lag/TTL_kinect length (ratio): {lag} / {len(TTL_kinect)} ({abs(lag)/len(TTL_kinect):.3f})")
 
             if abs(lag)/len(TTL_kinect) > .30:
@@ -198,7 +213,7 @@ if __name__ == "__main__":
                 with pd.option_context('future.no_silent_downcasting', True):
                     k = kinect_scaled["Contact_Area"].ffill().values
                 n = nerve["Freq"].values
-                lag = get_correlation(k, n, downsampling=0.1)
+                lag = get_correlation(k, n, coarse_factor=lag_coarse_factor)
 
                 print(f"lag/Contact_Area length (ratio): {lag} / {len(TTL_kinect)} ({abs(lag) / len(TTL_kinect):.3f})")
                 if abs(lag) / len(TTL_kinect) > .30:
@@ -0,0 +1,80 @@
+import importlib.util
+import numpy as np
+import os
+import sys
+import timeit
+
+# homemade libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from libraries.processing.semicontrolled_signal_lag import estimate_lag  # noqa: E402
+
+# the merging script can't be imported by name (it starts with a digit)
+spec = importlib.util.spec_from_file_location(
+    "merge_kinect_nerve", os.path.join(os.path.dirname(__file__), '..', '4.2_merge_kinect_nerve.py'))
+merge_kinect_nerve = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(merge_kinect_nerve)
+
+
+def create_ttl_train(nsamples, rng, pulse_min=5, pulse_max=400, gap_min=50, gap_max=3000):
+    # TTL signal made of pulses of random widths and intervals (in samples)
+    ttl = np.zeros(nsamples)
+    idx = rng.integers(gap_min, gap_max)
+    while idx < nsamples:
+        width = rng.integers(pulse_min, pulse_max)
+        ttl[idx:idx + width] = 1
+        idx += width + rng.integers(gap_min, gap_max)
+    return ttl
+
+
+def shift_signal(sig, lag, nsamples):
+    # sig delayed by lag samples (advanced if negative), cropped/padded with zeros to nsamples
+    if lag >= 0:
+        shifted = np.concatenate((np.zeros(lag), sig))
+    else:
+        shifted = sig[-lag:]
+    return np.pad(shifted, (0, max(nsamples - len(shifted), 0)))[:nsamples]
+
+
+if __name__ == "__main__":
+    # nerve sampling rate (~1 kHz) over a block of a few minutes
+    nsamples = 300_000
+    ntrials = 20
+    rng = np.random.default_rng(0)
+
+    methods = {
+        "downsampling 0.1 (legacy)": lambda s1, s2: merge_kinect_nerve.get_correlation(s1, s2, downsampling=0.1),
+        "full rate FFT": lambda s1, s2: merge_kinect_nerve.get_correlation(s1, s2),
+        "coarse to fine (x10)": lambda s1, s2: merge_kinect_nerve.get_correlation(s1, s2, coarse_factor=10),
+        "coarse to fine (x30)": lambda s1, s2: merge_kinect_nerve.get_correlation(s1, s2, coarse_factor=30),
+    }
+    errors = {name: [] for name in methods}
+    elapsed = {name: 0.0 for name in methods}
+    subsample_errors = []
+
+    for trial in range(ntrials):
+        ttl_nerve = create_ttl_train(nsamples, rng)
+        true_lag = int(rng.integers(-nsamples // 5, nsamples // 5))
+        ttl_kinect = shift_signal(ttl_nerve, true_lag, nsamples)
+        # the Kinect TTL is the LED state: a few frames can be misclassified
+        flipped = rng.random(nsamples) < 0.001
+        ttl_kinect[flipped] = 1 - ttl_kinect[flipped]
+
+        for name, method in methods.items():
+            start_time = timeit.default_timer()
+            lag = method(ttl_kinect, ttl_nerve)
+            elapsed[name] += timeit.default_timer() - start_time
+            errors[name].append(lag - true_lag)
+
+        # fractional offset: the kinect TTL is a smoothed version of the nerve TTL shifted by a sub-sample lag
+        fractional_lag = true_lag + rng.uniform(-0.5, 0.5)
+        t = np.arange(nsamples)
+        smooth_nerve = np.convolve(ttl_nerve, np.hanning(31), mode="same")
+        smooth_kinect = np.interp(t - fractional_lag, t, smooth_nerve, left=0, right=0)
+        subsample_errors.append(estimate_lag(smooth_kinect, smooth_nerve, subsample=True) - fractional_lag)
+
+    for name in methods:
+        abs_errors = np.abs(errors[name])
+        print(f"{name:28s}: exact = {np.sum(abs_errors == 0)}/{ntrials}, max error = {abs_errors.max()} samples, "
+              f"time = {elapsed[name] / ntrials * 1000:.1f} ms per call")
+    print(f"{'parabolic refinement':28s}: max error = {np.max(np.abs(subsample_errors)):.3f} samples "
+          f"(fractional offsets)")
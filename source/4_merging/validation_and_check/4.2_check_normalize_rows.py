@@ -0,0 +1,62 @@
+import numpy as np
+import os
+import sys
+import warnings
+
+# homemade libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+from libraries.processing.semicontrolled_data_cleaning import normalize_signal  # noqa: E402
+from libraries.processing.semicontrolled_data_correct_lag import normalize_rows, rows_with_range  # noqa: E402
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    nlags = 1001
+
+    # correlations of the trials (rows): random ones, and flat ones (no contact/spike in the window)
+    correlations = rng.normal(size=(20, nlags))
+    flat_rows = [3, 7, 11, 15]
+    correlations[3] = 0  # zero signal
+    correlations[7] = 2.5  # constant signal
+    correlations[11] = np.nan  # signal normalised by a zero range (only NaN values)
+    correlations[15] = np.nan
+    correlations[15, 100] = 1.0  # a single value
+    correlations[0, :10] = np.nan  # some NaN values in a valid row
+
+    failures = 0
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", category=RuntimeWarning)
+        normalized = normalize_rows(correlations)
+        valid_rows = rows_with_range(correlations)
+
+    expected_valid = np.ones(len(correlations), dtype=bool)
+    expected_valid[flat_rows] = False
+    if not np.array_equal(valid_rows, expected_valid):
+        print(f"FAILED: valid rows {np.flatnonzero(~valid_rows)} instead of {flat_rows}")
+        failures += 1
+
+    for row in range(len(correlations)):
+        if row in flat_rows:
+            expected = np.zeros(nlags)
+        else:
+            expected = normalize_signal(correlations[row], dtype=np.ndarray)
+        if not np.allclose(normalized[row], expected, equal_nan=True):
+            print(f"FAILED: row {row}")
+            failures += 1
+
+    if np.any(np.isinf(normalized)) or np.any(np.isnan(normalized[valid_rows][:, 10:])):
+        print("FAILED: NaN/inf values in the normalised correlations")
+        failures += 1
+
+    # the best lag of each trial only comes from the valid rows (a flat row would give the first lag)
+    lags = np.arange(-500, 501)
+    correlations[~valid_rows] = 0
+    true_lags = rng.integers(-100, 100, size=len(correlations))
+    for row in np.flatnonzero(valid_rows):
+        correlations[row, true_lags[row] + 500] = 100
+    best_lags = lags[np.nanargmax(correlations[rows_with_range(correlations)], axis=1)]
+    if not np.array_equal(best_lags, true_lags[valid_rows]):
+        print("FAILED: best lags of the valid rows")
+        failures += 1
+
+    print("OK" if not failures else f"{failures} FAILED")
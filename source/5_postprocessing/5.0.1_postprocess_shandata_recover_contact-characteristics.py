@@ -19,6 +19,7 @@ import warnings
 # current_dir = Path(__file__).resolve()
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 import libraries.misc.path_tools as path_tools  # noqa: E402
+from libraries.processing.semicontrolled_signal_lag import cross_correlation_window_batch  # noqa: E402
 import numpy as np
 
 
@@ -50,9 +51,14 @@ def plot_with_synced_zoom(df1, df2, df3, colnames=None, labels = None, title_str
 
 
 def find_best_offset(matrix1, matrix2, offset_bounds=(-120, 120), num_offsets=None, verbose=False):
+    # Offset (in rows) of matrix2 that maximises the correlation coefficient of the flattened matrices,
+    # matrix2 being shifted down by offset rows and zero-padded.
     # Replace NaN values with 0
-    matrix1 = np.nan_to_num(matrix1, nan=0.0)
-    matrix2 = np.nan_to_num(matrix2, nan=0.0)
+    matrix1 = np.nan_to_num(np.asarray(matrix1, dtype=np.float64), nan=0.0)
+    matrix2 = np.nan_to_num(np.asarray(matrix2, dtype=np.float64), nan=0.0)
+    if matrix1.ndim == 1:
+        matrix1 = matrix1[:, np.newaxis]
+        matrix2 = matrix2[:, np.newaxis]
 
     # Adjust the bounds to be within the valid range
     min_offset = int(max(offset_bounds[0], -matrix1.shape[0] + 1))
@@ -69,44 +75,46 @@ def find_best_offset(matrix1, matrix2, offset_bounds=(-120, 120), num_offsets=No
     
     if verbose:
         print(f"Step size for offsets: {step_size}")
-    
-    # Find the index of the maximum correlation within the specified offset range
-    max_correlation = -np.inf
-    best_offset = 0
-    
-    total_steps = (max_offset - min_offset) // step_size + 1
-    current_step = 0
-    last_printed_progress = -1
-    
-    for offset in range(min_offset, max_offset + 1, step_size):
-        current_step += 1
-        progress = (current_step / total_steps) * 100
-        progress_int = int(progress)
-        
-        if verbose and progress_int != last_printed_progress:
-            print(f"Progress: {progress_int}%")
-            last_printed_progress = progress_int
-        
-        # Create a zero-padded version of matrix2 based on the offset
-        if offset > 0:
-            matrix2_offset = np.pad(matrix2, ((offset, 0), (0, 0)), mode='constant', constant_values=0)[:-offset, :]
-        elif offset < 0:
-            matrix2_offset = np.pad(matrix2, ((0, -offset), (0, 0)), mode='constant', constant_values=0)[-offset:, :]
-        else:
-            matrix2_offset = matrix2
-        
-        # Flatten the matrices to 1D arrays
-        flat_matrix1 = np.array(matrix1).flatten()
-        flat_matrix2 = np.array(matrix2_offset).flatten()
-        
-        # Calculate the correlation coefficient
-        correlation_value = np.corrcoef(flat_matrix1, flat_matrix2)[0, 1]
 
-        if correlation_value > max_correlation:
-            max_correlation = correlation_value
-            best_offset = offset
-    
-    return best_offset, max_correlation
+    if max_offset < min_offset:
+        return 0, -np.inf
+
+    # Sum of the products of matrix1 and the shifted matrix2 for all the offsets at once:
+    # sum of the cross-correlations of the columns (one batched FFT)
+    correlations, offsets = cross_correlation_window_batch(matrix1.T, matrix2.T, min_offset, max_offset)
+    sum_products = correlations.sum(axis=0)[::step_size]
+    offsets = offsets[::step_size]
+
+    # Sums of the part of matrix2 that remains in the matrix after the shift (from cumulative sums of the rows)
+    nrows = matrix2.shape[0]
+    cumsum2 = np.concatenate(([0], np.cumsum(matrix2.sum(axis=1))))
+    cumsum2_squared = np.concatenate(([0], np.cumsum((matrix2 ** 2).sum(axis=1))))
+    first_row = np.maximum(-offsets, 0)
+    last_row = nrows - np.maximum(offsets, 0)
+    sum2 = cumsum2[last_row] - cumsum2[first_row]
+    sum2_squared = cumsum2_squared[last_row] - cumsum2_squared[first_row]
+
+    # Pearson correlation coefficient (as np.corrcoef of the flattened matrices)
+    n = matrix1.size
+    sum1 = matrix1.sum()
+    sum1_squared = (matrix1 ** 2).sum()
+    var1 = sum1_squared - sum1 ** 2 / n
+    var2 = sum2_squared - sum2 ** 2 / n
+    # a constant (or zero-filled) matrix has a zero variance, but the round-off of the sums leaves a tiny
+    # value instead: it is set to NaN (undefined coefficient, as np.corrcoef) rather than giving inf
+    var_tolerance = 1e-9
+    var2 = np.where(var2 <= var_tolerance * sum2_squared, np.nan, var2)
+    if var1 <= var_tolerance * sum1_squared:
+        var1 = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation_values = (sum_products - sum1 * sum2 / n) / np.sqrt(var1 * var2)
+
+    # Find the maximum correlation within the specified offset range (constant matrices give NaN)
+    valid = ~np.isnan(correlation_values)
+    if not np.any(valid):
+        return 0, -np.inf
+    best_idx = np.flatnonzero(valid)[np.argmax(correlation_values[valid])]
+    return int(offsets[best_idx]), correlation_values[best_idx]
 
 def zeropad_dataframe(contact_data_sept, contact_data_jan):
     rows_jan = contact_data_jan.shape[0]
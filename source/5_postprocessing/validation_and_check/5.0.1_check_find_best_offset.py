@@ -0,0 +1,74 @@
+import importlib.util
+import numpy as np
+import os
+import sys
+
+# homemade libraries
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+# the postprocessing script can't be imported by name (it starts with a digit)
+spec = importlib.util.spec_from_file_location(
+    "recover_contact_characteristics",
+    os.path.join(os.path.dirname(__file__), '..', '5.0.1_postprocess_shandata_recover_contact-characteristics.py'))
+recover_contact_characteristics = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(recover_contact_characteristics)
+
+
+def find_best_offset_reference(matrix1, matrix2, offset_bounds=(-120, 120), num_offsets=None):
+    # former implementation: shift matrix2 by each offset and compute np.corrcoef of the flattened matrices
+    matrix1 = np.nan_to_num(np.asarray(matrix1, dtype=np.float64), nan=0.0)
+    matrix2 = np.nan_to_num(np.asarray(matrix2, dtype=np.float64), nan=0.0)
+    min_offset = int(max(offset_bounds[0], -matrix1.shape[0] + 1))
+    max_offset = int(min(offset_bounds[1], matrix1.shape[0] - 1))
+    step_size = int(max(1, (max_offset - min_offset) // num_offsets)) if num_offsets is not None else 1
+    max_correlation = -np.inf
+    best_offset = 0
+    for offset in range(min_offset, max_offset + 1, step_size):
+        if offset > 0:
+            matrix2_offset = np.pad(matrix2, ((offset, 0), (0, 0)))[:-offset, :]
+        elif offset < 0:
+            matrix2_offset = np.pad(matrix2, ((0, -offset), (0, 0)))[-offset:, :]
+        else:
+            matrix2_offset = matrix2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation_value = np.corrcoef(matrix1.flatten(), matrix2_offset.flatten())[0, 1]
+        if correlation_value > max_correlation:
+            max_correlation = correlation_value
+            best_offset = offset
+    return best_offset, max_correlation
+
+
+def check(name, matrix1, matrix2, offset_bounds, num_offsets=None):
+    expected = find_best_offset_reference(matrix1, matrix2, offset_bounds, num_offsets)
+    result = recover_contact_characteristics.find_best_offset(matrix1, matrix2, offset_bounds, num_offsets)
+    same_offset = result[0] == expected[0]
+    same_correlation = np.isclose(result[1], expected[1]) or (np.isinf(result[1]) and result[1] == expected[1])
+    print(f"{name:45s}: expected = {expected}, result = {result} -> {'OK' if same_offset and same_correlation else 'FAILED'}")
+    return same_offset and same_correlation
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    ok = True
+
+    # random walks shifted by a known lag, with NaN values
+    for trial in range(10):
+        n, ncols = int(rng.integers(200, 2000)), int(rng.integers(1, 4))
+        base = np.cumsum(rng.normal(size=(n + 400, ncols)), axis=0)
+        lag = int(rng.integers(-150, 150))
+        matrix1 = base[200:200 + n]
+        matrix2 = base[200 - lag:200 - lag + n] + rng.normal(scale=0.5, size=(n, ncols))
+        matrix1[rng.random(matrix1.shape) < 0.05] = np.nan
+        ok &= check(f"random walk, lag {lag}", matrix1, matrix2, (-np.round(n / 2), np.round(n / 2)))
+
+    # constant-valued overlaps: the variance is 0 (undefined coefficient) and must not win with inf
+    for trial in range(50):
+        n = 100
+        matrix1 = rng.normal(size=(n, 1))
+        matrix2 = np.zeros((n, 1))
+        matrix2[:int(rng.integers(10, 40))] = 3.7  # constant values followed by zeros (NaN in the csv)
+        ok &= check(f"constant overlap {trial}", matrix1, matrix2, (-n, n))
+    ok &= check("constant matrix1", np.full((100, 2), 2.5), rng.normal(size=(100, 2)), (-50, 50))
+    ok &= check("all zero matrix2", rng.normal(size=(100, 2)), np.zeros((100, 2)), (-50, 50))
+
+    print("all checks passed" if ok else "SOME CHECKS FAILED")
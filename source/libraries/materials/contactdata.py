@@ -8,28 +8,28 @@ from sklearn.decomposition import PCA  # from pyppca import ppca  # pip install
 from .metadata import Metadata  # noqa: E402
 from libraries.materials.stimulusinfo import StimulusInfo  # noqa: E402
 from libraries.misc.interpolate_nan_values import interpolate_nan_values  # noqa: E402
+from libraries.misc.index_to_slice import index_to_slice  # noqa: E402
+from .trial_store import TrialArray, TrialStore  # noqa: E402
 
 
 class ContactData:
-    def __init__(self):
-        self._time: list[float] = []
-        self.nsample: int = 0
+    # the per-sample signals are stored in the TrialStore of the trial (time base shared with the neural data)
+    __slots__ = ("store", "_pos_1D", "pos_axis")
 
-        self._TTL: list = []  # float or nans
-        self._green_levels: list = []  # float or nans
+    KINECT_FS = 30  # Hz
 
-        self._contact_flag: list[float] = []  # ON/OFF
+    TTL = TrialArray("contact")  # float or nans
+    green_levels = TrialArray("contact")  # float or nans
+    contact_flag = TrialArray("contact")  # ON/OFF
+    area = TrialArray("contact")  # mm^2
+    depth = TrialArray("contact")  # mm
+    vel = TrialArray("contact")  # mm/sec
 
-        self._area: list[float] = []  # mm^2
-        self._depth: list[float] = []  # mm
-
-        self._pos: list[float] = []  # mm
-
-        self._pos_1D: list[float] = []  # mm
-        self._vel: list[float] = []  # mm/sec
-
-        self.data_Fs = None  # Hz
-        self.KINECT_FS = 30  # Hz
+    def __init__(self, store=None):
+        self.store = store if store is not None else TrialStore()
+        self._pos_1D = None  # mm, computed from pos when read (None: not computed yet)
+        # projection of pos onto pos_1D: (origin, direction) of the PCA axis, None until a PCA is fitted
+        self.pos_axis = None
 
     def interpolate_missing_values(self, method="linear"):
         if method not in ['linear', 'nearest', 'zero', 'slinear', 'quadratic', 'cubic']:
@@ -51,9 +51,10 @@ class ContactData:
         # Interpolation
         self.area = interpolate(self.area, method=method)
         self.depth = interpolate(self.depth, method=method)
-        self.pos[0, :] = interpolate(self.pos[0, :], method=method)
-        self.pos[1, :] = interpolate(self.pos[1, :], method=method)
-        self.pos[2, :] = interpolate(self.pos[2, :], method=method)
+        # new array rather than in place: pos can be a view of the trial it was sliced from
+        self.pos = np.array([interpolate(self.pos[0, :], method=method),
+                             interpolate(self.pos[1, :], method=method),
+                             interpolate(self.pos[2, :], method=method)])
 
     def get_contact_mask(self, curr_max_vel_ratio, mode="hard"):
         depth_smooth = self.get_smooth_depth(curr_max_vel_ratio, nframe=1)
@@ -114,153 +115,68 @@ class ContactData:
 
         return area_values
 
-    def get_data_idx(self, idx):
-        cd = ContactData()
-
-        cd.time = self.time[idx]
-        # since 2024/07/09, dataset doesn't contain green levels anymore
-        # Using shan's csv file means loosing the TTL information
-        try:
-            cd.TTL = self.TTL[idx]
-            cd.green_levels = self.green_levels[idx]
-        except:
-            pass
-
-        cd.contact_flag = self.contact_flag[idx]
-        cd.area = self.area[idx]
-        cd.depth = self.depth[idx]
-        try:
-            cd.pos = self.pos[:, idx]
-        except:
-            pass
-        try:
-            cd.vel = self.vel[:, idx]
-        except:
-            pass
-
+    def get_data_idx(self, idx, store=None):
+        # store: the sliced TrialStore if already done by the caller (SemiControlledData slices it once)
+        if store is None:
+            # views of the arrays if idx is a range of consecutive indices
+            store = self.store.get_data_idx(index_to_slice(idx))
+        cd = ContactData(store)
+        # the slice is projected onto the axis of the trial if it is already known (no new PCA fit)
+        cd.pos_axis = self.pos_axis
         return cd
 
-    def set_data_idx(self, idx):
-        self.time = self.time[idx]
-
-        try:
-            self.TTL = self.TTL[idx]  
-            self.green_levels = self.green_levels[idx]
-        except:
-            pass
-
-        self.contact_flag = self.contact_flag[idx]
-        self.area = self.area[idx]
-        self.depth = self.depth[idx]
-        try:
-            self.pos = self.pos[:, idx]
-        except:
-            pass
-        try:
-            self.vel = self.vel[:, idx]
-        except:
-            pass
+    # set_data_idx/append: the time base is shared with the neural data and the metadata of the trial,
+    # the trial is narrowed/appended as a whole by SemiControlledData.set_data_idx/append
 
-    def append(self, contact_bis):
-        self.time = np.concatenate((self.time, contact_bis.time))
-
-        self.TTL = np.concatenate((self.TTL, contact_bis.TTL))
-        try:
-            self.green_levels = np.concatenate((self.green_levels, contact_bis.green_levels))
-        except:
-            pass
-
-        self.contact_flag = np.concatenate((self.contact_flag, contact_bis.contact_flag))
-        self.area = np.concatenate((self.area, contact_bis.area))
-        self.depth = np.concatenate((self.depth, contact_bis.depth))
-        try:
-            self.pos = np.concatenate((self.pos, contact_bis.pos), axis=1)
-        except:
-            pass
-        try:
-            self.vel = np.concatenate((self.vel, contact_bis.vel), axis=1)
-        except:
-            pass
-
-        self._TTL: list[float] = []
-        self._green_levels: list[float] = []
+    def clear_TTL(self):
+        # the TTL and green levels are not kept after an append
+        self.store.remove("contact.TTL")
+        self.store.remove("contact.green_levels")
 
     @property
     def time(self):
-        return self._time
+        return self.store.time
 
     @time.setter
     def time(self, value):
-        self._time = value
-        self.nsample = len(self._time)
-        self.data_Fs = 1 / np.nanmean(np.diff(self._time))  # Hz
+        self.store.time = value
 
     @property
-    def TTL(self):
-        return self._TTL
-
-    @TTL.setter
-    def TTL(self, value):
-        self._TTL = value
+    def nsample(self):
+        return self.store.nsample
 
     @property
-    def green_levels(self):
-        return self._green_levels
-
-    @green_levels.setter
-    def green_levels(self, value):
-        self._green_levels = value
-
-    @property
-    def contact_flag(self):
-        return self._contact_flag
-
-    @contact_flag.setter
-    def contact_flag(self, value):
-        self._contact_flag = value
-
-    @property
-    def area(self):
-        return self._area
-
-    @area.setter
-    def area(self, value):
-        self._area = value
-
-    @property
-    def depth(self):
-        return self._depth
-
-    @depth.setter
-    def depth(self, value):
-        self._depth = value
-
-    @property
-    def vel(self):
-        return self._vel
-
-    @vel.setter
-    def vel(self, value):
-        self._vel = value
+    def data_Fs(self):
+        return self.store.data_Fs  # Hz
 
     @property
     def pos(self):
-        return self._pos
+        return self.store.arrays.get("contact.pos", [])  # mm
 
     @pos.setter
     def pos(self, value):
-        self._pos = value
-        self.update_pos_1D()
+        self.store.arrays["contact.pos"] = value
+        self.reset_pos_1D()
+
+    def reset_pos_1D(self):
+        # the 1D position is computed when it is read (a PCA fit is costly for every slice of the data)
+        self._pos_1D = None
+        self.pos_axis = None
 
     def update_pos_1D(self):
         # compress the signal into 1D (as the expected motion is supposed to be 1D anyway)
-        # is there is nan, use a github provided PCA to ignore nan
+        # is there is nan, the centered signal is interpolated before the PCA
+
+        if not len(self.pos):
+            self._pos_1D = []
+            return
 
         if np.all(np.isnan(self.pos)):
-            self.pos_1D = np.nan(len(self.pos[0]))
+            self._pos_1D = np.full(len(self.pos[0]), np.nan)
             return
 
         pos3D = self.pos.transpose()
+        offset = 0
 
         if np.isnan(pos3D).any():
             nsamples, _ = np.shape(pos3D)
@@ -269,19 +185,26 @@ class ContactData:
             pos3D_centered = pos3D - np.matlib.repmat(M, nsamples, 1)
             # interpolate the nan values
             pos3D = interpolate_nan_values(pos3D_centered)
+            offset = M
 
         # if there is some value
-        if np.any(pos3D != 0):
+        if not np.any(pos3D != 0):
+            # fill up the vector to avoid any warnings from PCA.fit_transform
+            self._pos_1D = np.zeros(len(self.pos[0]))
+        elif self.pos_axis is not None:
+            # reuse the axis of the trial this data comes from
+            origin, direction = self.pos_axis
+            self._pos_1D = (pos3D + offset - origin) @ direction
+        else:
             # get the first PCA
             pca = PCA(n_components=1)
-            self.pos_1D = np.squeeze(pca.fit_transform(pos3D))
-        else:
-            # fill up the vector to avoid any warnings from PCA.fit_transform
-            self.pos_1D = np.zeros(len(self.pos[0]))
-
+            self._pos_1D = np.squeeze(pca.fit_transform(pos3D))
+            self.pos_axis = (pca.mean_ + offset, pca.components_[0])
 
     @property
     def pos_1D(self):
+        if self._pos_1D is None:
+            self.update_pos_1D()
         return self._pos_1D
 
     @pos_1D.setter
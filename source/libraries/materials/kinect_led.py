@@ -2,11 +2,43 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 import pandas as pd
-from scipy.interpolate import interp1d
 
 from ..misc.waitforbuttonpress_popup import WaitForButtonPressPopup
 
 
+# Columns of the LED time series: name in the csv file -> name in the npz file
+LED_TIMESERIES_COLUMNS = {"time (second)": "time", "green level": "green_level", "LED on": "led_on"}
+
+
+def get_led_timeseries_npz_filename(csv_filename_abs):
+    return os.path.splitext(csv_filename_abs)[0] + ".npz"
+
+
+def save_led_timeseries_npz(npz_filename_abs, time, green_levels, led_on):
+    # Columnar binary copy of the LED time series (csv file), read in bulk by read_led_timeseries
+    np.savez(npz_filename_abs,
+             time=np.asarray(time, dtype=np.float64),
+             green_level=np.asarray(green_levels, dtype=np.float64),
+             led_on=np.asarray(led_on, dtype=np.float64))
+
+
+def read_led_timeseries(csv_filename_abs):
+    # DataFrame of the LED time series with the csv columns. The npz file next to the csv file is read instead
+    # if it exists and is not older than the csv file (the csv file is only kept as an export).
+    npz_filename_abs = get_led_timeseries_npz_filename(csv_filename_abs)
+    if os.path.isfile(npz_filename_abs) and \
+            (not os.path.isfile(csv_filename_abs) or
+             os.path.getmtime(npz_filename_abs) >= os.path.getmtime(csv_filename_abs)):
+        with np.load(npz_filename_abs) as data:
+            df = pd.DataFrame({csv_name: data[npz_name] for csv_name, npz_name in LED_TIMESERIES_COLUMNS.items()})
+        # "LED on" is stored as float in the npz file (NaN where the LED is occluded):
+        # back to integers when there is no NaN value, as written in the exported files
+        if not df["LED on"].isna().any():
+            df["LED on"] = df["LED on"].astype(np.int64)
+        return df
+    return pd.read_csv(csv_filename_abs)
+
+
 # class of the LED green value of videos for the processing
 class SemiControlledKinectLED:
     def __init__(self):
@@ -16,9 +48,9 @@ class SemiControlledKinectLED:
         self.timeseries_filename = []
         self.metadata_filename = []
 
-        self.time = []
-        self.green_levels = []
-        self.led_on = []
+        self.time = np.zeros(0)
+        self.green_levels = np.zeros(0)
+        self.led_on = np.zeros(0)
 
     def load_timeseries(self, led_files_info, dropna=False):
         self.session = led_files_info["session"]
@@ -27,12 +59,12 @@ class SemiControlledKinectLED:
         self.timeseries_filename = led_files_info["timeseries_filename"]
         self.metadata_filename = led_files_info["metadata_filename"]
 
-        df = pd.read_csv(os.path.join(led_files_info["file_path"], led_files_info["timeseries_filename"]))
+        df = read_led_timeseries(os.path.join(led_files_info["file_path"], led_files_info["timeseries_filename"]))
         if dropna:
             df.dropna(inplace=True)  # if dropna, remove lines that contains NaN values
-        self.time = [round(num, 5) for num in df["time (second)"].values]
-        self.green_levels = [round(num, 5) for num in df["green level"].values]
-        self.led_on = df["LED on"].values
+        self.time = np.round(df["time (second)"].to_numpy(dtype=np.float64), 5)
+        self.green_levels = np.round(df["green level"].to_numpy(dtype=np.float64), 5)
+        self.led_on = df["LED on"].to_numpy(dtype=np.float64)
 
     def load_class_list_from_infos(self, led_files_info_list):
         data_led_list = []
@@ -53,14 +85,10 @@ class SemiControlledKinectLED:
         # reset potential non start to zero.
         new_time = new_time - new_time[0]
 
-        # Find the index of the first 1
-        start = 0
-        while start < len(self.led_on) and self.led_on[start] == 0:
-            start += 1
-        # Find the index of the last 1
-        end = len(self.led_on) - 1
-        while end >= 0 and self.led_on[end] == 0:
-            end -= 1
+        # Find the index of the first and of the last 1 (any non zero value)
+        led_on_idx = np.flatnonzero(self.led_on != 0)
+        start = led_on_idx[0] if len(led_on_idx) else len(self.led_on)
+        end = led_on_idx[-1] if len(led_on_idx) else -1
         time_essential = self.time[start:end] - self.time[start]
 
         # display basic info
@@ -76,13 +104,12 @@ class SemiControlledKinectLED:
 
         new_time = np.linspace(self.time[0], self.time[-1], len(new_time))
 
-        # Create interpolation functions
-        interp_func_led_on = interp1d(self.time, self.led_on, kind='nearest')  # 'linear', 'quadratic', 'cubic'
-        interp_func_green_levels = interp1d(self.time, self.green_levels, kind='linear')  # 'linear', 'quadratic', 'cubic'
-
-        # Interpolate the values at the new time points
-        self.led_on = interp_func_led_on(new_time)
-        self.green_levels = interp_func_green_levels(new_time)
+        # Interpolate the values at the new time points:
+        #  - led_on: nearest sample (ties to the previous sample, as interp1d(kind='nearest')),
+        #  - green_levels: linear.
+        nearest_idx = np.searchsorted((self.time[1:] + self.time[:-1]) / 2, new_time, side='left')
+        self.led_on = self.led_on[nearest_idx]
+        self.green_levels = np.interp(new_time, self.time, self.green_levels)
 
         # replace the old time vector by the new one
         self.time = new_time
@@ -1,10 +1,18 @@
-import numpy as np
+import copy
 import re
 import warnings
 
+from .trial_store import TrialStore  # noqa: E402
+from ..misc.index_to_slice import index_to_slice  # noqa: E402
+
 
 class Metadata:
-    def __init__(self, data_filename, md_stim_filename, md_neuron_filename):
+    # the time base is stored in the TrialStore of the trial (shared with the contact and neural data)
+    __slots__ = ("store", "data_filename", "md_stim_filename", "data_filename_short", "unit_name2type_filename",
+                 "block_id", "trial_id")
+
+    def __init__(self, data_filename, md_stim_filename, md_neuron_filename, store=None):
+        self.store = store if store is not None else TrialStore()
         self.data_filename = data_filename
         self.md_stim_filename = md_stim_filename
         self.data_filename_short = data_filename.split("\\")[-1]
@@ -22,28 +30,24 @@ class Metadata:
         else:
             self.trial_id: float = 0
 
-        self._time: list[float] = []
-        self.nsample: int = 0
-
-        self.data_Fs = 0  # Hz
-
     def set_refreshRate(self):
-        self.data_Fs = 1/np.nanmean(np.diff(self._time))  # Hz
+        # data_Fs is computed again from the time base when it is read
+        self.store.reset_data_Fs()
 
-    def get_data_idx(self, idx):
-        md = Metadata(self.data_filename, self.md_stim_filename, self.unit_name2type_filename)
-        md.time = self.time[idx]
-        md.block_id = self.block_id
-        md.trial_id = self.trial_id
+    def get_data_idx(self, idx, store=None):
+        # shallow copy: the filenames and ids are shared, no regex parsing again
+        md = copy.copy(self)
+        # store: the sliced TrialStore if already done by the caller (SemiControlledData slices it once)
+        if store is None:
+            # views of the arrays if idx is a range of consecutive indices
+            store = self.store.get_data_idx(index_to_slice(idx))
+        md.store = store
         return md
 
-    def set_data_idx(self, idx):
-        self.time = self.time[idx]
-        self.block_id = self.block_id
-        self.trial_id = self.trial_id
+    # set_data_idx/append: the time base is shared with the contact and neural data of the trial,
+    # the trial is narrowed/appended as a whole by SemiControlledData.set_data_idx/append
 
-    def append(self, md_bis):
-        self.time = np.concatenate((self.time, md_bis.time))
+    def warn_if_different_ids(self, md_bis):
         if self.block_id != md_bis.block_id:
             warnings.warn("Warning: trial_ids are not equal.", UserWarning)
         if self.trial_id != md_bis.trial_id:
@@ -51,10 +55,16 @@ class Metadata:
 
     @property
     def time(self):
-        return self._time
+        return self.store.time
 
     @time.setter
     def time(self, value):
-        self._time = value
-        self.nsample = len(self._time)
-        self.set_refreshRate()
+        self.store.time = value
+
+    @property
+    def nsample(self):
+        return self.store.nsample
+
+    @property
+    def data_Fs(self):
+        return self.store.data_Fs  # Hz
@@ -0,0 +1,54 @@
+import os
+import threading
+import pandas as pd
+
+
+# Metadata csv files loaded once per process and indexed by key column:
+#   filename -> (mtime, {key: row index}, {column: values})
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_indexed_csv(filename, key_column):
+    # Load (or reuse) the csv file indexed by the values of key_column (first row kept for duplicated keys).
+    # The file is read again if it has been modified since it was loaded.
+    filename = os.path.abspath(filename)
+    mtime = os.path.getmtime(filename)
+    registry_key = (filename, key_column)
+    with _registry_lock:
+        entry = _registry.get(registry_key)
+        if entry is not None and entry[0] == mtime:
+            return entry[1], entry[2]
+
+    df = pd.read_csv(filename)
+    columns = {col: df[col].values for col in df.columns}
+    index = {}
+    for row_idx, key in enumerate(df[key_column].values):
+        index.setdefault(key, row_idx)
+
+    with _registry_lock:
+        _registry[registry_key] = (mtime, index, columns)
+    return index, columns
+
+
+def _get_row(filename, key_column, key):
+    index, columns = _get_indexed_csv(filename, key_column)
+    row_idx = index.get(key)
+    if row_idx is None:
+        return None
+    return {col: values[row_idx] for col, values in columns.items()}
+
+
+def get_unit_metadata(unit_name2type_filename, unit_name):
+    # Row of the neuron metadata csv (unit name to type) of the unit as a dict, None if the unit is not listed
+    return _get_row(unit_name2type_filename, "Unit_name", unit_name)
+
+
+def get_stimulus_metadata(md_stim_filename, trial_id):
+    # Row of the stimuli csv of a block (one file per block) for the trial as a dict, None if the trial is not listed
+    return _get_row(md_stim_filename, "trial_id", trial_id)
+
+
+def clear_metadata_registry():
+    with _registry_lock:
+        _registry.clear()
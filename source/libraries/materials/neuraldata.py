@@ -1,18 +1,25 @@
 import chardet
+import copy
 import numpy as np
 import os
-import pandas as pd
 import re
 import warnings
 
+from .metadata_registry import get_unit_metadata  # noqa: E402
+from .trial_store import TrialArray, TrialStore  # noqa: E402
+from ..misc.index_to_slice import index_to_slice  # noqa: E402
+
+
 class NeuralData:
-    def __init__(self, data_filename, unit_name2type_filename):
-        self._time: list[float] = []
-        self.nsample: int = 0
-        self.data_Fs = None  # Hz
-        self.spike: list[float] = []
-        self.iff: list[float] = []
-        self.TTL: list[float] = []
+    # the per-sample signals are stored in the TrialStore of the trial (time base shared with the contact data)
+    __slots__ = ("store", "unit_id", "unit_type", "conduction_vel", "dist_electrode", "latency")
+
+    spike = TrialArray("neural")
+    iff = TrialArray("neural")
+    TTL = TrialArray("neural")
+
+    def __init__(self, data_filename, unit_name2type_filename, store=None):
+        self.store = store if store is not None else TrialStore()
 
         self.unit_id = None
         self.unit_type = None
@@ -32,14 +39,13 @@ class NeuralData:
             pass
 
         try:
-            # select the metadata information of the current neuron
-            df = pd.read_csv(unit_name2type_filename)
-            df = df[df.Unit_name == self.unit_id]
+            # select the metadata information of the current neuron (csv file loaded once per process)
+            unit_md = get_unit_metadata(unit_name2type_filename, self.unit_id)
             # get current unit type
-            self.unit_type = df["Unit_type"].values[0]
+            self.unit_type = unit_md["Unit_type"]
             # get current conduction velocity
-            self.conduction_vel = df["conduction_velocity (m/s)"].values[0]
-            self.dist_electrode = df["electrode_endorgan_distance (cm)"].values[0]
+            self.conduction_vel = unit_md["conduction_velocity (m/s)"]
+            self.dist_electrode = unit_md["electrode_endorgan_distance (cm)"]
             self.latency = (self.dist_electrode/100) / self.conduction_vel
         except:
             pass
@@ -53,52 +59,31 @@ class NeuralData:
             self.spike = np.pad(self.spike, (0, -lag), 'constant')[-lag:]
             self.iff = np.pad(self.iff, (0, -lag), 'constant')[-lag:]
 
-    def get_data_idx(self, idx):
-        neural = NeuralData("", "")
-        neural.time = self.time[idx]
-        neural.spike = self.spike[idx]
-        neural.iff = self.iff[idx]
-        
-        # Using shan's csv file means loosing the TTL information
-        try:
-            neural.TTL = self.TTL[idx]
-        except:
-            pass
-
-        neural.unit_id = self.unit_id
-        neural.unit_type = self.unit_type
-        neural.conduction_vel = self.conduction_vel
-        neural.dist_electrode = self.dist_electrode
-        neural.latency = self.latency
-
+    def get_data_idx(self, idx, store=None):
+        # shallow copy: the unit information is shared, the neuron metadata csv is not read again
+        neural = copy.copy(self)
+        # store: the sliced TrialStore if already done by the caller (SemiControlledData slices it once)
+        if store is None:
+            # views of the arrays if idx is a range of consecutive indices
+            store = self.store.get_data_idx(index_to_slice(idx))
+        neural.store = store
         return neural
 
-    def set_data_idx(self, idx):
-        self.time = self.time[idx]
-        self.spike = self.spike[idx]
-        self.iff = self.iff[idx]
-        # Using shan's csv file means loosing the TTL information
-        try:
-            self.TTL = self.TTL[idx]
-        except:
-            pass
-
-    def append(self, neural_bis):
-        self.time = np.concatenate((self.time, neural_bis.time))
-        self.spike = np.concatenate((self.spike, neural_bis.spike))
-        self.iff = np.concatenate((self.iff, neural_bis.iff))
-        self.TTL = np.concatenate((self.TTL, neural_bis.TTL))
+    # set_data_idx/append: the time base is shared with the contact data and the metadata of the trial,
+    # the trial is narrowed/appended as a whole by SemiControlledData.set_data_idx/append
 
     @property
     def time(self):
-        return self._time
+        return self.store.time
 
     @time.setter
     def time(self, value):
-        self._time = value
-        self.nsample = len(self._time)
-        dt = np.diff(self._time)
-        if not len(dt) == 0:
-            self.data_Fs = 1 / np.nanmean(dt)  # Hz
-            #print(np.nanmean(dt))
-            #print(self.data_Fs)
+        self.store.time = value
+
+    @property
+    def nsample(self):
+        return self.store.nsample
+
+    @property
+    def data_Fs(self):
+        return self.store.data_Fs  # Hz
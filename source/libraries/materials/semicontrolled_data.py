@@ -9,16 +9,21 @@ from ..materials.metadata import Metadata  # noqa: E402
 from ..materials.stimulusinfo import StimulusInfo  # noqa: E402
 from ..materials.contactdata import ContactData  # noqa: E402
 from ..materials.neuraldata import NeuralData  # noqa: E402
+from ..materials.metadata_registry import get_stimulus_metadata  # noqa: E402
+from ..materials.trial_store import TrialStore  # noqa: E402
+from ..misc.index_to_slice import index_to_slice  # noqa: E402
 #import ..misc.time_cost_function as time_cost
 #from libraries.misc.semicontrolled_data_visualizer import SemiControlledDataVisualizer  # noqa: E402
 
 
 class SemiControlledData:
     def __init__(self, data_csv_filename, md_stim_filename="", md_neuron_filename="", load_instant=False, dropna=False):
-        self.md: Metadata = Metadata(data_csv_filename, md_stim_filename, md_neuron_filename)
+        # one time base and struct of arrays for the metadata, neural and contact data of the trial
+        store = TrialStore()
+        self.md: Metadata = Metadata(data_csv_filename, md_stim_filename, md_neuron_filename, store=store)
         self.stim: StimulusInfo = StimulusInfo(md_stim_filename)
-        self.neural: NeuralData = NeuralData(data_csv_filename, md_neuron_filename)
-        self.contact: ContactData = ContactData()
+        self.neural: NeuralData = NeuralData(data_csv_filename, md_neuron_filename, store=store)
+        self.contact: ContactData = ContactData(store=store)
 
         # allows to determine if the signal is considered good
         # based on expected stimulus information given to the experimenter
@@ -92,13 +97,15 @@ class SemiControlledData:
             warnings.warn(f"metadata stimulus filename doesn't exist: Ignore stimulus characteristics.")
             return
 
-        df = pd.read_csv(self.md.md_stim_filename)
-        current_row = df[df['trial_id'] == self.md.trial_id]
+        # stimuli csv file of the block loaded once per process
+        current_row = get_stimulus_metadata(self.md.md_stim_filename, self.md.trial_id)
+        if current_row is None:
+            raise IndexError(f"trial {self.md.trial_id} not found in <{self.md.md_stim_filename}>")
         # stimulus info
-        self.stim.type = current_row.type.values[0]
-        self.stim.vel = current_row.speed.values[0]
-        self.stim.size = current_row.contact_area.values[0]
-        self.stim.force = current_row.force.values[0]
+        self.stim.type = current_row["type"]
+        self.stim.vel = current_row["speed"]
+        self.stim.size = current_row["contact_area"]
+        self.stim.force = current_row["force"]
 
     def load_contact(self, df):
         self.contact.time = df.t.values
@@ -154,31 +161,56 @@ class SemiControlledData:
             scd = copy.deepcopy(self)
             scd.set_data_idx(idx)
         else:
-            # cost 0.2 ms
-            scd = SemiControlledData(self.md.data_filename, self.md.md_stim_filename, self.md.unit_name2type_filename)
-            scd.stim = self.stim.get_data()
-            scd.md = self.md.get_data_idx(idx)
-            scd.contact = self.contact.get_data_idx(idx)
-            scd.neural = self.neural.get_data_idx(idx)
+            # shallow copy: no csv read, the stimulus information is shared by reference
+            # and the arrays are views of the current ones if idx is a range of consecutive indices
+            scd = copy.copy(self)
+            scd.trust_score = 0
+            # all the signals of the trial are sliced at once
+            store = self.md.store.get_data_idx(index_to_slice(idx))
+            scd.md = self.md.get_data_idx(idx, store=store)
+            scd.contact = self.contact.get_data_idx(idx, store=store)
+            scd.neural = self.neural.get_data_idx(idx, store=store)
 
         return scd
 
     def set_data_idx(self, idx):
-        if isinstance(idx, range):
-            idx = list(idx)
-        elif isinstance(idx, tuple):
-            idx = list(range(idx[0], idx[1]))
+        if isinstance(idx, tuple):
+            idx = range(idx[0], idx[1])
+        idx = index_to_slice(idx)
 
-        self.md.set_data_idx(idx)
-        self.contact.set_data_idx(idx)
-        self.neural.set_data_idx(idx)
+        # the metadata, contact and neural data share the same trial store: narrowed once
+        self.md.store.set_data_idx(idx)
+        self.contact.reset_pos_1D()
 
     def append(self, scd_bis):
         if not self.stim.is_similar(scd_bis.stim):
             warnings.warn("Warning: stimulus variables are not equal.", UserWarning)
-        self.md.append(scd_bis.md)
-        self.contact.append(scd_bis.contact)
-        self.neural.append(scd_bis.neural)
+        # the metadata, contact and neural data share the same trial store: appended once
+        self.md.store.append(scd_bis.md.store)
+        self.md.warn_if_different_ids(scd_bis.md)
+        self.contact.reset_pos_1D()
+        self.contact.clear_TTL()
+
+    @classmethod
+    def concat(cls, scd_list):
+        # One SemiControlledData from a list of pieces (e.g. the trials of a unit), with one concatenation per signal.
+        # Same result as appending the pieces one by one to (a shallow copy of) the first one.
+        scd_first = scd_list[0]
+        for scd_bis in scd_list[1:]:
+            if not scd_first.stim.is_similar(scd_bis.stim):
+                warnings.warn("Warning: stimulus variables are not equal.", UserWarning)
+            scd_first.md.warn_if_different_ids(scd_bis.md)
+
+        store = TrialStore.concat([scd_bis.md.store for scd_bis in scd_list])
+        scd = copy.copy(scd_first)
+        scd.md = copy.copy(scd_first.md)
+        scd.md.store = store
+        scd.neural = copy.copy(scd_first.neural)
+        scd.neural.store = store
+        scd.contact = ContactData(store=store)
+        if len(scd_list) > 1:
+            scd.contact.clear_TTL()
+        return scd
 
     def get_contact_mask(self):
         m = None
@@ -0,0 +1,148 @@
+import numpy as np
+
+
+class TrialStore:
+    # Struct of arrays of a trial: one time base shared by the metadata, contact and neural data
+    # of the trial, and their per-sample signals stored by name (the last axis is the sample axis).
+    # Slicing/appending the store does it once for all the signals, and nsample/data_Fs are
+    # derived from the time base only (data_Fs when it is read).
+    # Appended stores are kept as pending pieces and concatenated at once when the data is read:
+    # appending N pieces one by one costs one allocation per signal instead of N growing copies.
+    __slots__ = ("_time", "nsample", "_data_Fs", "_arrays", "_pending")
+
+    def __init__(self, time=None):
+        self._time = []
+        self.nsample = 0
+        self._data_Fs = None
+        self._arrays = {}
+        self._pending = []
+        if time is not None:
+            self.time = time
+
+    @classmethod
+    def concat(cls, stores):
+        # One store from a list of stores (same result as appending them one by one to the first one)
+        store = cls()
+        store._time, store._arrays = concatenate_pieces([(s.time, s.arrays) for s in stores])
+        store.nsample = len(store._time)
+        return store
+
+    @property
+    def arrays(self):
+        self.consolidate()
+        return self._arrays
+
+    @arrays.setter
+    def arrays(self, value):
+        self.consolidate()
+        self._arrays = value
+
+    @property
+    def time(self):
+        self.consolidate()
+        return self._time
+
+    @time.setter
+    def time(self, value):
+        self.consolidate()
+        self._time = value
+        self.nsample = len(value)
+        self._data_Fs = None
+
+    @property
+    def data_Fs(self):
+        if self._data_Fs is None and self.nsample > 1:
+            self._data_Fs = 1 / np.nanmean(np.diff(self.time))  # Hz
+        return self._data_Fs
+
+    def reset_data_Fs(self):
+        self._data_Fs = None
+
+    def get_data_idx(self, idx):
+        store = TrialStore(self.time[idx])
+        for name, values in self.arrays.items():
+            if isinstance(values, list):
+                values = np.asarray(values)
+            try:
+                store.arrays[name] = values[..., idx]
+            except (TypeError, IndexError):
+                # not a per-sample signal (e.g. NaN when the dataset doesn't contain it): left unset
+                pass
+        return store
+
+    def set_data_idx(self, idx):
+        sliced = self.get_data_idx(idx)
+        self.time = sliced.time
+        self.arrays = sliced.arrays
+
+    def append(self, store_bis):
+        # the piece is concatenated when the data is read (snapshot of its current arrays)
+        time_bis = store_bis.time
+        self._pending.append((time_bis, dict(store_bis.arrays)))
+        self.nsample += len(time_bis)
+        self._data_Fs = None
+
+    def remove(self, name):
+        # remove a signal from the store and from the pending pieces (same result as consolidating
+        # the pieces first, without concatenating them on every append)
+        self._arrays.pop(name, None)
+        for _, piece_arrays in self._pending:
+            piece_arrays.pop(name, None)
+
+    def consolidate(self):
+        if not self._pending:
+            return
+        pieces = [(self._time, self._arrays)] + self._pending
+        self._pending = []
+        self._time, self._arrays = concatenate_pieces(pieces)
+
+
+def concatenate_pieces(pieces):
+    # Concatenation of (time, arrays) pieces along the sample axis: (time, arrays) with the signals of all the pieces.
+    # A signal missing from a piece (or not per-sample in it, e.g. NaN when the dataset doesn't contain it)
+    # is filled with NaN values over that piece. A signal that is per-sample in none of the pieces is kept
+    # as it is in the first piece that has it.
+    time = np.concatenate([piece_time for piece_time, _ in pieces])
+    names = []
+    for _, piece_arrays in pieces:
+        names.extend(name for name in piece_arrays if name not in names)
+
+    arrays = {}
+    for name in names:
+        pieces_values = []
+        leading_shape = None
+        for piece_time, piece_arrays in pieces:
+            values = piece_arrays.get(name)
+            if values is not None and np.ndim(values) and np.shape(values)[-1] == len(piece_time):
+                values = np.asarray(values)
+                if leading_shape is None:
+                    leading_shape = values.shape[:-1]
+            else:
+                values = None
+            pieces_values.append(values)
+
+        if leading_shape is None:
+            arrays[name] = next(piece_arrays[name] for _, piece_arrays in pieces if name in piece_arrays)
+            continue
+        arrays[name] = np.concatenate(
+            [values if values is not None else np.full(leading_shape + (len(piece_time),), np.nan)
+             for values, (piece_time, _) in zip(pieces_values, pieces)], axis=-1)
+    return time, arrays
+
+
+class TrialArray:
+    # Attribute of ContactData/NeuralData stored in their TrialStore under "<prefix>.<name>"
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.key = None
+
+    def __set_name__(self, owner, name):
+        self.key = f"{self.prefix}.{name}"
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.store.arrays.get(self.key, [])
+
+    def __set__(self, obj, value):
+        obj.store.arrays[self.key] = value
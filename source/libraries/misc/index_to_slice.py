@@ -0,0 +1,20 @@
+import numpy as np
+
+
+def index_to_slice(idx):
+    # Convert a range or an array/list of consecutive indices into a slice, so that indexing
+    # a numpy array returns a view instead of a copy. Any other index (boolean mask, ...) is returned as is.
+    if isinstance(idx, slice):
+        return idx
+    if isinstance(idx, range):
+        if idx.step == 1 and idx.start >= 0:
+            return slice(idx.start, max(idx.stop, idx.start))
+        return idx
+    if isinstance(idx, (list, np.ndarray)):
+        idx_array = np.asarray(idx)
+        if idx_array.ndim != 1 or not len(idx_array) or idx_array.dtype.kind not in "iu":
+            return idx
+        start = int(idx_array[0])
+        if start >= 0 and int(idx_array[-1]) - start == len(idx_array) - 1 and np.all(np.diff(idx_array) == 1):
+            return slice(start, start + len(idx_array))
+    return idx
@@ -0,0 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import numpy as np
+import os
+import subprocess
+import tempfile
+import warnings
+
+
+# ffprobe results are stored on disk and reused as long as the video file is unchanged (same size/mtime).
+# The location can be changed with the SEMICONTROLLED_VIDEO_METADATA_CACHE environment variable.
+METADATA_CACHE_FILENAME = os.environ.get(
+    "SEMICONTROLLED_VIDEO_METADATA_CACHE",
+    os.path.join(os.path.expanduser("~"), ".semicontrolled", "video_metadata_cache.json"))
+
+_metadata_cache = None
+
+
+def load_metadata_cache():
+    global _metadata_cache
+    if _metadata_cache is None:
+        _metadata_cache = read_metadata_cache_file()
+    return _metadata_cache
+
+
+def read_metadata_cache_file():
+    if not os.path.isfile(METADATA_CACHE_FILENAME):
+        return {}
+    try:
+        with open(METADATA_CACHE_FILENAME, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        warnings.warn(f"Video metadata cache <{METADATA_CACHE_FILENAME}> couldn't be read, it is ignored.")
+        return {}
+
+
+def save_metadata_cache_entry(key, entry):
+    cache = load_metadata_cache()
+    cache[key] = entry
+    # merge with the entries written meanwhile by other processes (e.g. batch processing),
+    # and replace the file atomically so that a reader never gets a partially written file
+    cache_on_disk = read_metadata_cache_file()
+    cache_on_disk.update(cache)
+    cache.update(cache_on_disk)
+    cache_dir = os.path.dirname(METADATA_CACHE_FILENAME)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache_on_disk, f, indent=1)
+        os.replace(tmp_filename, METADATA_CACHE_FILENAME)
+    except OSError:
+        warnings.warn(f"Video metadata cache <{METADATA_CACHE_FILENAME}> couldn't be written.")
+
+
+def get_metadata_cache_key(video_path):
+    return os.path.normcase(os.path.abspath(video_path))
+
+
+def get_video_metadata(video_path):
+    # Cached video information: ffprobe streams (index, width, height, frame rate, ...) and the
+    # number of frames once it has been counted. The entry is invalidated if the file size or mtime changes.
+    key = get_metadata_cache_key(video_path)
+    stat = os.stat(video_path)
+    entry = load_metadata_cache().get(key)
+    if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry
+
+    probe = subprocess.run([
+        *"ffprobe -v quiet -print_format json -show_format -show_streams".split(),
+        video_path
+    ], capture_output=True)
+    probe.check_returncode()
+    entry = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "streams": json.loads(probe.stdout)["streams"],
+        "nframes": None
+    }
+    save_metadata_cache_entry(key, entry)
+    return entry
+
+
+def probe_video_stream(video_path, stream_idx=0):
+    # COLOR/RGB channels (or stream) in Kinect videos are located in 0
+    stream = get_video_metadata(video_path)["streams"][stream_idx]
+    if stream["codec_type"] != "video":
+        warnings.warn("PROBLEM: Expected stream for RGB video is not a video")
+    return stream
+
+
+def get_cached_nframes(video_path):
+    # number of decoded frames if it has already been counted, None otherwise
+    return get_video_metadata(video_path)["nframes"]
+
+
+def set_cached_nframes(video_path, nframes):
+    entry = dict(get_video_metadata(video_path))
+    entry["nframes"] = int(nframes)
+    save_metadata_cache_entry(get_metadata_cache_key(video_path), entry)
+
+
+def get_frame_rate(stream):
+    num, denom = map(int, stream['avg_frame_rate'].split('/'))
+    return num / denom
+
+
+def predict_nframes(stream, default=0):
+    # number of frames given by the container (often missing for MKV)
+    if stream.get("nb_frames") is not None:
+        return int(stream["nb_frames"])
+    # otherwise, estimate it with the duration of the stream and its frame rate
+    duration = stream.get("duration", stream.get("tags", {}).get("DURATION"))
+    frame_rate = stream.get("avg_frame_rate", "0/0")
+    num, denom = map(int, frame_rate.split('/'))
+    if duration is None or not denom or not num:
+        return default
+    if ":" in str(duration):  # Matroska tag format: HH:MM:SS.nnnnnnnnn
+        h, m, sec = str(duration).split(":")
+        duration = 3600 * int(h) + 60 * int(m) + float(sec)
+    return int(np.ceil(float(duration) * num / denom))
+
+
+def count_nframes_without_decoding(video_path, stream_index=0, tolerance=0.001):
+    # Exact number of frames from the frame index (one video packet holds one frame), or None if it
+    # can't be trusted, in which case the video has to be decoded to count its frames.
+    # The container is demuxed once (the index is reused for the random access to the frames), the count is
+    # verified against the duration of the stream, and by decoding the last frame only.
+    stream = probe_video_stream(video_path, stream_index)
+    # variable frame rate: the duration doesn't verify the count
+    if stream.get("r_frame_rate") != stream.get("avg_frame_rate"):
+        return None
+    nframes = get_indexed_nframes(video_path, stream_index)
+    if not nframes:
+        return None
+    nframes_predicted = predict_nframes(stream, default=None)
+    if nframes_predicted is not None and abs(nframes - nframes_predicted) > 1 + tolerance * nframes_predicted:
+        warnings.warn(f"Frame index ({nframes} frames) and stream duration ({nframes_predicted} frames) disagree "
+                      f"for <{video_path}>: the frames will be counted by decoding the video.")
+        return None
+    if read_frame(video_path, nframes - 1, stream_index) is None:
+        return None
+    return nframes
+
+
+def get_square_region(square_center, square_size, frame_width, frame_height):
+    # Define the square region, bounded by the frame borders
+    half_size = square_size // 2
+    x_start = max(square_center[0] - half_size, 0)
+    x_end = min(square_center[0] + half_size, frame_width)
+    y_start = max(square_center[1] - half_size, 0)
+    y_end = min(square_center[1] + half_size, frame_height)
+    return x_start, x_end, y_start, y_end
+
+
+def get_crop_filter(x_start, x_end, y_start, y_end, pix_fmt="rgb24"):
+    # The conversion to rgb24 is done before cropping so that the crop is pixel exact
+    # (cropping a yuv420 stream rounds odd coordinates to the chroma grid),
+    # hence the output is identical to slicing the full rgb24 frame with NumPy.
+    return f"format={pix_fmt},crop={x_end - x_start}:{y_end - y_start}:{x_start}:{y_start}"
+
+
+def get_rawvideo_cmd(video_path, stream_index, crop_region=None, pix_fmt="rgb24"):
+    # pix_fmt="bgr24" gives the same frames as cv2.VideoCapture
+    cmd = ["ffmpeg", "-i", video_path]
+    cmd += "-map", f"0:{stream_index}"
+    if crop_region is not None:
+        # only the pixels of the region of interest cross the pipe
+        cmd += "-vf", get_crop_filter(*crop_region, pix_fmt=pix_fmt)
+    cmd += "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"
+    return cmd
+
+
+def get_rawvideo_frame_shape(frame_width, frame_height, crop_region=None):
+    if crop_region is not None:
+        x_start, x_end, y_start, y_end = crop_region
+        return np.array([y_end - y_start, x_end - x_start, 3])
+    return np.array([frame_height, frame_width, 3])
+
+
+def readinto_full(stream, buffer):
+    # Fill the buffer from the stream, a pipe can return less than asked: returns the number
+    # of bytes read, which is smaller than the buffer size only at the end of the stream
+    nread = 0
+    while nread < len(buffer):
+        n = stream.readinto(buffer[nread:])
+        if not n:
+            break
+        nread += n
+    return nread
+
+
+def read_rawvideo_frames(cmd, frame_shape, nbuffers=1):
+    # Generator of the frames piped out of ffmpeg, one at a time (see read_rawvideo_stream).
+    # If the consumer stops early, the pipe is closed: ffmpeg stops on its next write.
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
+        yield from read_rawvideo_stream(proc.stdout, frame_shape, nbuffers)
+
+
+def read_rawvideo_stream(stream, frame_shape, nbuffers=1):
+    # Generator of the frames of a rawvideo stream (e.g. the stdout of ffmpeg), one at a time.
+    # The stream is read directly into a ring of nbuffers preallocated frames (no allocation per frame):
+    # a yielded frame is a view that is overwritten nbuffers frames later, copy it to keep it.
+    # An incomplete last frame is ignored with a warning.
+    frame_shape = tuple(int(n) for n in frame_shape)
+    buffers = np.empty((nbuffers, *frame_shape), dtype=np.uint8)
+    buffer_views = [memoryview(buffer).cast('B') for buffer in buffers]  # One byte per each element
+    buffer_idx = 0
+    while True:
+        nread = readinto_full(stream, buffer_views[buffer_idx])
+        if nread == 0:
+            break
+        if nread < len(buffer_views[buffer_idx]):
+            warnings.warn(f"Incomplete last frame ({nread} bytes instead of "
+                          f"{len(buffer_views[buffer_idx])}) piped out of ffmpeg, it is ignored.")
+            break
+        yield buffers[buffer_idx]
+        buffer_idx = (buffer_idx + 1) % nbuffers
+
+
+def get_frame_index_filename(video_path, stream_index=0):
+    # frame indexes are too large for the json cache, they are stored next to it (one file per video stream)
+    key = f"{get_metadata_cache_key(video_path)}:{stream_index}"
+    index_dir = os.path.join(os.path.dirname(METADATA_CACHE_FILENAME), "frame_index")
+    return os.path.join(index_dir, hashlib.md5(key.encode('utf-8')).hexdigest() + ".npz")
+
+
+def get_frame_index(video_path, stream_index=0):
+    # Presentation timestamps (seconds) of every frame of the stream, in display order, and their keyframe flags.
+    # The index is built once from the packets of the container (demuxing only, no decoding),
+    # then reused as long as the video file is unchanged (same size/mtime).
+    stat = os.stat(video_path)
+    index_filename = get_frame_index_filename(video_path, stream_index)
+    if os.path.isfile(index_filename):
+        try:
+            with np.load(index_filename) as index:
+                if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime:
+                    return index["pts"], index["keyframe"]
+        except (OSError, ValueError, KeyError):
+            warnings.warn(f"Frame index <{index_filename}> couldn't be read, it is rebuilt.")
+
+    probe = subprocess.run([
+        *"ffprobe -v quiet -select_streams".split(), str(stream_index),
+        *"-show_entries packet=pts_time,flags -of csv=print_section=0".split(),
+        video_path
+    ], capture_output=True, text=True)
+    probe.check_returncode()
+    pts = []
+    keyframe = []
+    for line in probe.stdout.splitlines():
+        fields = line.strip().split(',')
+        # packets without timestamp don't hold a displayed frame
+        if len(fields) < 2 or fields[0] in ("", "N/A"):
+            continue
+        pts.append(float(fields[0]))
+        keyframe.append('K' in fields[1])
+    # packets are listed in decoding order, frames are displayed in timestamp order (B-frames)
+    order = np.argsort(pts, kind="stable")
+    pts = np.asarray(pts, dtype=np.float64)[order]
+    keyframe = np.asarray(keyframe, dtype=bool)[order]
+
+    try:
+        os.makedirs(os.path.dirname(index_filename), exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(index_filename), suffix=".npz")
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, pts=pts, keyframe=keyframe, size=stat.st_size, mtime=stat.st_mtime)
+        os.replace(tmp_filename, index_filename)
+    except OSError:
+        warnings.warn(f"Frame index <{index_filename}> couldn't be written.")
+    return pts, keyframe
+
+
+def get_frame_seek_time(pts, frame_idx):
+    # ffmpeg accurate seeking decodes from the preceding keyframe and drops the frames displayed before
+    # the seek time: seeking halfway between the previous frame and the requested one is robust
+    # to the rounding of the timestamps to the time base of the container.
+    if frame_idx == 0:
+        return pts[0]
+    return (pts[frame_idx - 1] + pts[frame_idx]) / 2
+
+
+def read_frame(video_path, frame_idx, stream_index=0, pix_fmt="bgr24"):
+    # Exact random access to one frame (BGR by default, as returned by cv2.VideoCapture), None if out of range
+    pts, _ = get_frame_index(video_path, stream_index)
+    if not 0 <= frame_idx < len(pts):
+        return None
+    stream = probe_video_stream(video_path, stream_index)
+    cmd = ["ffmpeg", "-v", "quiet", "-seek_timestamp", "1",
+           "-ss", f"{get_frame_seek_time(pts, frame_idx):.6f}", "-i", video_path]
+    cmd += "-map", f"0:{stream_index}", "-frames:v", "1"
+    cmd += "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"
+    proc = subprocess.run(cmd, capture_output=True)
+    frame_shape = get_rawvideo_frame_shape(stream["width"], stream["height"])
+    if proc.returncode != 0 or len(proc.stdout) != np.prod(frame_shape):
+        return None
+    return np.frombuffer(proc.stdout, dtype=np.uint8).reshape(frame_shape)
+
+
+def read_frames(video_path, frame_indices, stream_index=0, pix_fmt="bgr24", n_workers=8):
+    # Random access to several frames: each frame is decoded by its own ffmpeg process, run concurrently
+    get_frame_index(video_path, stream_index)  # build the index once, before the workers use it
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(lambda frame_idx: read_frame(video_path, frame_idx, stream_index, pix_fmt),
+                                 frame_indices))
+
+
+def get_indexed_nframes(video_path, stream_index=0):
+    pts, _ = get_frame_index(video_path, stream_index)
+    return len(pts)
@@ -5,10 +5,15 @@ import csv
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from scipy.stats import norm
 from sklearn import mixture
-import subprocess
 import warnings
 
+from .semicontrolled_Kinect_roi_writer import load_roi_chunks
+from ..materials.kinect_led import save_led_timeseries_npz
+from .semicontrolled_Kinect_ffmpeg import (get_square_region, get_rawvideo_cmd, get_rawvideo_frame_shape,
+                                            probe_video_stream, get_frame_rate, read_rawvideo_frames,
+                                            set_cached_nframes)
 from ..misc.time_cost_function import time_it
 from ..misc.waitforbuttonpress_popup import WaitForButtonPressPopup
 from ..processing.semicontrolled_data_cleaning import normalize_signal
@@ -59,64 +64,104 @@ class KinectLEDBlinking:
 
         self.video_path = "None"
 
-    def load_video(self):
+    def load_video(self, square_center=None, square_size=None):
         # Clean area of interest variable
         self.roi = []
 
         # COLOR/RGB channels (or stream) in Kinect videos are located in 0
-        info = subprocess.run([
-            *"ffprobe -v quiet -print_format json -show_format -show_streams".split(),
-            self.video_path
-        ], capture_output=True)
-        info.check_returncode()
-        stream_rgb = json.loads(info.stdout)["streams"][0]
-        if stream_rgb["codec_type"] != "video":
-            warnings.warn("PROBLEM: Expected stream for RGB video is not a video")
+        stream_rgb = probe_video_stream(self.video_path)
         # get mp4 channel's rgb
         index = stream_rgb["index"]
         # get frame X.Y
         frame_height = stream_rgb["height"]
         frame_width = stream_rgb["width"]
         # get fps
-        frame_rate = stream_rgb['avg_frame_rate']
-        num, denom = map(int, frame_rate.split('/'))
-        self.fps = num / denom
-
-        frame_shape = np.array([frame_height, frame_width, 3])
-        nelem = frame_shape.prod()
-        nframes = 0
-
-        cmd = ["ffmpeg", "-i", self.video_path]
-        cmd += "-map", f"0:{index}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
-            while True:
-                data = proc.stdout.read(nelem)  # One byte per each element
-                if not data:
-                    break
-                nframes += 1
-                frame = np.frombuffer(data, dtype=np.uint8).reshape(frame_shape)
-                self.roi.append(frame)
+        self.fps = get_frame_rate(stream_rgb)
+
+        # if the LED square is given, the video is cropped by ffmpeg itself (e.g. when reading the source video)
+        crop_region = None
+        if square_center is not None and square_size is not None:
+            crop_region = get_square_region(square_center, square_size, frame_width, frame_height)
+
+        frame_shape = get_rawvideo_frame_shape(frame_width, frame_height, crop_region=crop_region)
+        cmd = get_rawvideo_cmd(self.video_path, index, crop_region=crop_region)
+        for frame in read_rawvideo_frames(cmd, frame_shape):
+            # the reader reuses its buffer for the next frame
+            self.roi.append(frame.copy())
 
         self.roi = np.array(self.roi)
         self.nframes = self.roi.shape[0]
 
+    def load_video_chunks(self):
+        # lossless area of interest saved as .npy chunks by 2.1 (video_path is the directory of the chunks)
+        self.roi, self.fps = load_roi_chunks(self.video_path)
+        self.nframes = self.roi.shape[0]
+
     @time_it
-    def monitor_green_levels(self, show=False):
+    def process_video_single_pass(self, square_center=None, square_size=None, method="bimodal", threshold=0.25,
+                                  occlusion_threshold=40, chunk_size=4096, chunk_bytes=256 * 1024 ** 2):
+        # Fused pipeline (decode -> green level -> LED on -> occlusion) reading the source video only once.
+        # Only scalar series are kept: the green level and the sum of the pixel values of each frame.
+        # A chunk holds at most chunk_size frames and chunk_bytes bytes (e.g. ~40 full HD frames when
+        # there is no crop region, instead of 4096 frames: tens of GB).
+        stream_rgb = probe_video_stream(self.video_path)
+        index = stream_rgb["index"]
+        frame_height = stream_rgb["height"]
+        frame_width = stream_rgb["width"]
+        self.fps = get_frame_rate(stream_rgb)
+
+        crop_region = None
+        if square_center is not None and square_size is not None:
+            crop_region = get_square_region(square_center, square_size, frame_width, frame_height)
+        frame_shape = get_rawvideo_frame_shape(frame_width, frame_height, crop_region=crop_region)
+        chunk_size = max(1, min(chunk_size, chunk_bytes // int(np.prod(frame_shape))))
+        cmd = get_rawvideo_cmd(self.video_path, index, crop_region=crop_region)
+
+        green_levels = []
+        frame_sums = []
+        for chunk in iterate_chunks(read_rawvideo_frames(cmd, frame_shape), chunk_size):
+            green_levels.append(compute_green_levels(chunk, self.lower_green, self.upper_green))
+            frame_sums.append(chunk.reshape(len(chunk), -1).sum(axis=1, dtype=np.int64))
+        green_levels = np.concatenate(green_levels) if len(green_levels) else np.zeros(0)
+        frame_sums = np.concatenate(frame_sums) if len(frame_sums) else np.zeros(0, dtype=np.int64)
+
+        self.nframes = len(green_levels)
+        set_cached_nframes(self.video_path, self.nframes)
+        self.green_levels = normalize_signal(green_levels, dtype=np.ndarray)
+        self.time = np.linspace(0, 1 / self.fps * (self.nframes - 1), self.nframes)
+
+        # second pass over the scalar series only
+        self.process_led_on(method=method, threshold=threshold)
+
+        # The average LED OFF/ON frames are not available without a second decoding: their sum is
+        # estimated from the frame sums (no pixel-wise rounding, i.e. a difference < 0.5 on the distances).
+        led_on = np.asarray(self.led_on)
+        stats_off = (frame_sums[led_on == 0].sum(), np.count_nonzero(led_on == 0))
+        stats_on = (frame_sums[led_on == 1].sum(), np.count_nonzero(led_on == 1))
+        self.occluded, _, _ = compute_occlusion(frame_sums, np.prod(frame_shape), stats_off, stats_on,
+                                                occlusion_threshold)
+        if np.any(self.occluded):
+            print("Some occlusions have been detected.")
+            self.update_led_on()
+
+    @time_it
+    def monitor_green_levels(self, show=False, chunk_size=4096):
         if self.roi is None:
             raise Exception("Error: Area of Interest was not initialized.")
-        self.green_levels = np.zeros(self.nframes)
         if show:
+            # frame by frame to display the video
+            self.green_levels = np.zeros(self.nframes)
             cv2.namedWindow('Frame', cv2.WINDOW_NORMAL)
-        for idx, frame in enumerate(self.roi):
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-            mask = cv2.inRange(hsv, self.lower_green, self.upper_green)
-            roi = cv2.bitwise_and(frame, frame, mask=mask)
-            avg_green = np.mean(roi[:, :, 1])
-            self.green_levels[idx] = avg_green
-            if show:
+            for idx, frame in enumerate(self.roi):
+                self.green_levels[idx] = compute_green_levels(frame[np.newaxis], self.lower_green, self.upper_green)[0]
                 cv2.imshow('Frame', frame)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
+        else:
+            # batches of frames, chunk_size bounds the memory used by the HSV conversion
+            green_levels = [compute_green_levels(chunk, self.lower_green, self.upper_green)
+                            for chunk in iterate_chunks(self.roi, chunk_size)]
+            self.green_levels = np.concatenate(green_levels) if len(green_levels) else np.zeros(0)
         self.green_levels = normalize_signal(self.green_levels, dtype=np.ndarray)
         self.time = np.linspace(0, 1 / self.fps * (self.nframes - 1), self.nframes)
 
@@ -124,6 +169,8 @@ class KinectLEDBlinking:
         match method:
             case "bimodal":
                 self.process_led_on_bimodal()
+            case "bimodal_fast":
+                self.process_led_on_bimodal_fast()
             case "threshold":
                 self.process_led_on_threshold(threshold=threshold)
 
@@ -135,9 +182,10 @@ class KinectLEDBlinking:
         # create GMM model object
         gmm = mixture.GaussianMixture(n_components=2, max_iter=1000, random_state=10, covariance_type='full')
 
-        # find useful parameters
-        mean = gmm.fit(x).means_
-        gauss_idx_predicted = gmm.fit(x).predict(x)
+        # find useful parameters (fit once, the model is deterministic with random_state)
+        gmm.fit(x)
+        mean = gmm.means_
+        gauss_idx_predicted = gmm.predict(x)
 
         # if the first gaussian is the low green intensity gaussian,
         # label prediction works perfectly (0 or 1)
@@ -150,6 +198,28 @@ class KinectLEDBlinking:
         # https://stats.stackexchange.com/questions/311592/how-to-find-the-point-where-two-normal-distributions-intersect
         self.threshold_value = np.nan
 
+    def process_led_on_bimodal_fast(self, nsamples=5000, max_overlap=0.01):
+        # Fit the GMM on a stratified subsample of the green levels (one random frame per block of frames,
+        # which avoids aliasing with the blinking period), then classify the whole series with the threshold
+        # where both weighted gaussians intersect. If the two modes overlap too much (expected fraction of
+        # misclassified frames above max_overlap), the threshold is not reliable: fit on the full series.
+        x = np.asarray(self.green_levels, dtype=float)
+        step = max(1, len(x) // nsamples)
+        rng = np.random.default_rng(10)
+        idx = np.arange(0, len(x), step)
+        idx = np.minimum(idx + rng.integers(0, step, size=len(idx)), len(x) - 1)
+
+        gmm = mixture.GaussianMixture(n_components=2, max_iter=1000, random_state=10, covariance_type='full')
+        gmm.fit(x[idx].reshape(-1, 1))
+
+        threshold, overlap = get_gmm_threshold(gmm)
+        if threshold is None or overlap > max_overlap:
+            print(f"LED on> modes overlap ({overlap}), fit the gaussian mixture on the full series.")
+            self.process_led_on_bimodal()
+            return
+        self.led_on = (x > threshold).astype(int)
+        self.threshold_value = threshold
+
     def process_led_on_threshold(self, threshold=0.25):
         if self.green_levels is None:
             raise Exception("Error: green_levels was not initialized.")
@@ -160,25 +230,15 @@ class KinectLEDBlinking:
         led_on_idx = np.where(self.green_levels > self.threshold_value)[0]
         self.led_on[led_on_idx] = 1
 
-    def define_occlusion(self, threshold=40, show=False):
-        if self.roi is None or self.led_on is None:
+    def define_occlusion(self, threshold=40, show=False, frames=None, chunk_size=4096):
+        # frames can be any iterable of ROI frames (e.g. frames streamed from the decoder),
+        # so that occlusion is computed without keeping the ROI stack in memory
+        if frames is None:
+            frames = self.roi
+        if frames is None or self.led_on is None:
             raise Exception("Error: led_on was not initialized.")
-        self.occluded = np.full(self.nframes, False, dtype=bool)
-        frame_avg_off_idx = np.where(self.led_on == 0)[0]
-        frame_avg_on_idx = np.where(self.led_on == 1)[0]
-        frame_avg_off = np.round(np.mean(self.roi[frame_avg_off_idx, :, :, :], axis=0)).astype(int)
-        frame_avg_on = np.round(np.mean(self.roi[frame_avg_on_idx, :, :, :], axis=0)).astype(int)
-        means_off = []
-        means_on = []
-        for idx, frame in enumerate(self.roi):
-            frame_off = np.subtract(frame, frame_avg_off)
-            frame_on = np.subtract(frame, frame_avg_on)
-            mean_off = abs(np.mean(frame_off))
-            mean_on = abs(np.mean(frame_on))
-            means_off.append(mean_off)
-            means_on.append(mean_on)
-            if not (mean_off < threshold) or not (mean_on < threshold):
-                self.occluded[idx] = True
+        frame_sums, npixels, stats_off, stats_on = accumulate_occlusion_statistics(frames, self.led_on, chunk_size)
+        self.occluded, means_off, means_on = compute_occlusion(frame_sums, npixels, stats_off, stats_on, threshold)
         if show:
             fig, axs = plt.subplots(3, 1, sharex=True)
             axs[0].plot(means_off, label='LED OFF')
@@ -198,7 +258,7 @@ class KinectLEDBlinking:
             WaitForButtonPressPopup()
             plt.close()
             for idx, occlusion in enumerate(self.occluded):
-                if occlusion:
+                if occlusion and self.roi is not None:
                     plt.imshow(self.roi[idx, :, :, :])
                     plt.ion()
                     plt.draw()
@@ -246,10 +306,13 @@ class KinectLEDBlinking:
             self.led_on = np.array(self.led_on, dtype=float)
             self.led_on[occluded_idx] = np.nan
 
-    def save_results(self):
+    def save_results(self, save_npz=True):
         if not os.path.exists(self.result_dir_path):
             os.makedirs(self.result_dir_path)
         self.save_result_csv(self.result_dir_path, self.result_file_name + ".csv")
+        # columnar binary copy of the csv file, faster to load for the next steps
+        if save_npz:
+            self.save_result_npz(self.result_dir_path, self.result_file_name + ".npz")
         self.save_result_metadata(self.result_dir_path, self.result_file_name + "_metadata.txt")
 
     def save_result_csv(self, file_path, file_name):
@@ -260,6 +323,9 @@ class KinectLEDBlinking:
             for t_value, green_value, led_value in zip(self.time, self.green_levels, self.led_on):
                 writer.writerow([t_value, green_value, led_value])
 
+    def save_result_npz(self, file_path, file_name):
+        save_led_timeseries_npz(os.path.join(file_path, file_name), self.time, self.green_levels, self.led_on)
+
     def save_result_metadata(self, file_path, file_name):
         full_path = os.path.join(file_path, file_name)
         metadata = {
@@ -272,3 +338,111 @@ class KinectLEDBlinking:
         }
         with open(full_path, 'w') as f:
             json.dump(metadata, f, indent=4)
+
+
+def compute_green_levels(frames, lower_green, upper_green):
+    # Average green level of the pixels inside the green HSV range, for a stack of frames (N, H, W, 3).
+    # Frames are stacked vertically into one image as the conversion and the mask are pixel-wise,
+    # which gives the same result as cv2.cvtColor/inRange/bitwise_and applied frame by frame.
+    nframes, height, width, nchannels = frames.shape
+    if nframes == 0:
+        return np.zeros(0)
+    image = np.ascontiguousarray(frames).reshape(nframes * height, width, nchannels)
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, lower_green, upper_green)
+    green = np.where(mask, image[:, :, 1], 0).reshape(nframes, height * width)
+    return green.sum(axis=1, dtype=np.int64) / (height * width)
+
+
+def iterate_chunks(frames, chunk_size=4096):
+    # Yield chunks (n, H, W, 3) of a stack of frames, or of any iterable of frames (e.g. a decoder).
+    # For iterables, the chunk buffer is reused: a chunk is only valid until the next one is yielded.
+    if isinstance(frames, np.ndarray):
+        for start in range(0, len(frames), chunk_size):
+            yield frames[start:start + chunk_size]
+        return
+    chunk = None
+    n = 0
+    for frame in frames:
+        if chunk is None:
+            chunk = np.empty((chunk_size, *np.shape(frame)), dtype=np.uint8)
+        chunk[n] = frame
+        n += 1
+        if n == chunk_size:
+            yield chunk
+            n = 0
+    if n:
+        yield chunk[:n]
+
+
+def accumulate_occlusion_statistics(frames, led_on, chunk_size=4096):
+    # In one pass over the frames, get:
+    #   - the sum of the pixel values of each frame,
+    #   - the pixel-wise sum (and count) of the frames with the LED OFF, and with the LED ON.
+    led_on = np.asarray(led_on)
+    frame_sums = []
+    npixels = 0
+    sum_off = sum_on = None
+    n_off = n_on = 0
+    start = 0
+    for chunk in iterate_chunks(frames, chunk_size):
+        n = len(chunk)
+        if sum_off is None:
+            npixels = chunk[0].size
+            sum_off = np.zeros(chunk.shape[1:], dtype=np.int64)
+            sum_on = np.zeros(chunk.shape[1:], dtype=np.int64)
+        frame_sums.append(chunk.reshape(n, -1).sum(axis=1, dtype=np.int64))
+        off = (led_on[start:start + n] == 0)[:, np.newaxis, np.newaxis, np.newaxis]
+        on = (led_on[start:start + n] == 1)[:, np.newaxis, np.newaxis, np.newaxis]
+        sum_off += chunk.sum(axis=0, dtype=np.int64, where=off)
+        sum_on += chunk.sum(axis=0, dtype=np.int64, where=on)
+        n_off += np.count_nonzero(off)
+        n_on += np.count_nonzero(on)
+        start += n
+    if start != len(led_on):
+        warnings.warn(f"Number of frames ({start}) differs from the length of led_on ({len(led_on)}).")
+    frame_sums = np.concatenate(frame_sums) if len(frame_sums) else np.zeros(0, dtype=np.int64)
+    return frame_sums, npixels, (sum_off, n_off), (sum_on, n_on)
+
+
+def compute_occlusion(frame_sums, npixels, stats_off, stats_on, threshold=40):
+    # A frame is occluded when its average pixel value is too far from the average LED OFF or LED ON frame.
+    # mean(frame - frame_avg) == (sum(frame) - sum(frame_avg)) / npixels, hence there is no need for the
+    # full frames: only their sums are used (same values as the frame by frame subtraction).
+    def distance_to_average_frame(frame_sum_avg, count):
+        if count == 0:
+            return np.full(len(frame_sums), np.nan)
+        frame_avg = np.round(frame_sum_avg / count).astype(int)
+        return np.abs((frame_sums - frame_avg.sum()) / npixels)
+
+    means_off = distance_to_average_frame(*stats_off)
+    means_on = distance_to_average_frame(*stats_on)
+    occluded = ~(means_off < threshold) | ~(means_on < threshold)
+    return occluded, means_off, means_on
+
+
+def get_gmm_threshold(gmm):
+    # Intersection of the two weighted gaussians of a 1D GaussianMixture, between their means:
+    #   w_lo * N(x; m_lo, v_lo) = w_hi * N(x; m_hi, v_hi)  <=>  a*x^2 + b*x + c = 0
+    # https://stats.stackexchange.com/questions/311592/how-to-find-the-point-where-two-normal-distributions-intersect
+    # Returns the threshold and the expected fraction of misclassified samples with it (overlap of the modes).
+    lo, hi = np.argsort(gmm.means_[:, 0])
+    m_lo, m_hi = gmm.means_[lo, 0], gmm.means_[hi, 0]
+    v_lo, v_hi = gmm.covariances_.reshape(-1)[[lo, hi]]
+    w_lo, w_hi = gmm.weights_[[lo, hi]]
+
+    a = 1 / (2 * v_hi) - 1 / (2 * v_lo)
+    b = m_lo / v_lo - m_hi / v_hi
+    c = m_hi ** 2 / (2 * v_hi) - m_lo ** 2 / (2 * v_lo) + np.log((w_lo * np.sqrt(v_hi)) / (w_hi * np.sqrt(v_lo)))
+    if abs(a) < 1e-12:
+        roots = np.array([-c / b]) if b != 0 else np.array([])
+    else:
+        roots = np.roots([a, b, c])
+        roots = np.real(roots[np.isreal(roots)])
+    roots = roots[(roots > m_lo) & (roots < m_hi)]
+    if len(roots) == 0:
+        return None, np.inf
+    threshold = float(roots[0])
+
+    overlap = w_lo * norm.sf(threshold, m_lo, np.sqrt(v_lo)) + w_hi * norm.cdf(threshold, m_hi, np.sqrt(v_hi))
+    return threshold, float(overlap)
@@ -0,0 +1,118 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import pandas as pd
+import timeit
+import traceback
+import warnings
+
+from .semicontrolled_Kinect_led_blinking import KinectLEDBlinking
+from .semicontrolled_Kinect_led_blinking_mp4 import KinectLEDBlinkingMP4
+
+
+def create_led_blinking_job(md_filename_abs, video_filename_abs, output_dirname, output_filename,
+                            use_mp4=True, single_pass=False, force_processing=False, save_results=True,
+                            threshold=.20, occlusion_threshold=40):
+    # A job only contains basic types so that it can be sent to another process
+    return {
+        "md_filename_abs": md_filename_abs,
+        "video_filename_abs": video_filename_abs,
+        "output_dirname": output_dirname,
+        "output_filename": output_filename,
+        "use_mp4": use_mp4,
+        "single_pass": single_pass,
+        "force_processing": force_processing,
+        "save_results": save_results,
+        "threshold": threshold,
+        "occlusion_threshold": occlusion_threshold
+    }
+
+
+def process_led_blinking_job(job, show=False):
+    # Process one video of the LED blinking extraction (2.2) and return its summary row
+    summary = {
+        "file": job["output_filename"],
+        "video_path": job["video_filename_abs"],
+        "status": None,
+        "nframes": None,
+        "elapsed_time (second)": 0.0,
+        "error": ""
+    }
+    start_time = timeit.default_timer()
+    try:
+        # create Kinect processing manager
+        if job["use_mp4"]:
+            led_blink = KinectLEDBlinkingMP4(job["video_filename_abs"], job["output_dirname"], job["output_filename"])
+        else:
+            led_blink = KinectLEDBlinking(job["video_filename_abs"], job["output_dirname"], job["output_filename"])
+
+        if led_blink.is_already_processed() and not job["force_processing"]:
+            summary["status"] = "skipped"
+            return summary
+
+        if job["single_pass"]:
+            # the LED location and the source video are given by the ROI metadata (2.1)
+            with open(job["md_filename_abs"], 'r', encoding='utf-8') as file:
+                md_roi = json.load(file)
+            if md_roi["square_center"] is None or not os.path.exists(md_roi["video_path"]):
+                led_blink.create_phantom_result_file(job["md_filename_abs"])
+                summary["status"] = "phantom"
+            else:
+                led_blink.video_path = md_roi["video_path"]
+                led_blink.process_video_single_pass(md_roi["square_center"], md_roi["square_size"],
+                                                    threshold=job["threshold"],
+                                                    occlusion_threshold=job["occlusion_threshold"])
+                summary["status"] = "processed"
+        # Check if the video exists
+        elif not os.path.exists(job["video_filename_abs"]):
+            led_blink.create_phantom_result_file(job["md_filename_abs"])
+            summary["status"] = "phantom"
+        else:
+            if os.path.isdir(job["video_filename_abs"]):
+                led_blink.load_video_chunks()
+            else:
+                led_blink.load_video()
+            led_blink.monitor_green_levels(show=show)
+            led_blink.process_led_on(threshold=job["threshold"])
+            # correct for any occlusion
+            led_blink.define_occlusion(threshold=job["occlusion_threshold"], show=show)
+            summary["status"] = "processed"
+
+        if job["save_results"]:
+            led_blink.save_results()
+        summary["nframes"] = led_blink.nframes
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+    finally:
+        summary["elapsed_time (second)"] = timeit.default_timer() - start_time
+    return summary
+
+
+def run_led_blinking_batch(jobs, n_workers=None, summary_filename_abs=None, show=False):
+    # Process the jobs with a pool of processes (n_workers=None uses all the cores).
+    # n_workers=1 runs the jobs one after the other in the current process (required for show=True).
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if show and n_workers != 1:
+        warnings.warn("show is only available with n_workers=1: videos are processed without display.")
+        show = False
+
+    if n_workers == 1:
+        summaries = []
+        for job in jobs:
+            print(f"File '{job['output_filename']}'")
+            summaries.append(process_led_blinking_job(job, show=show))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # map keeps the order of the jobs in the summary
+            summaries = list(executor.map(process_led_blinking_job, jobs))
+
+    df = pd.DataFrame(summaries)
+    if len(df):
+        nfailed = (df["status"] == "failed").sum()
+        print(f"LED blinking batch> {len(df)} files, {nfailed} failed, "
+              f"total processing time = {df['elapsed_time (second)'].sum():.1f} seconds.")
+    if summary_filename_abs is not None:
+        df.to_csv(summary_filename_abs, index=False)
+    return df
@@ -5,9 +5,13 @@ import csv
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import subprocess
-import warnings
 
+from .semicontrolled_Kinect_roi_writer import ROIVideoWriter, ROIChunkWriter, ThreadedROIWriter
+from .semicontrolled_Kinect_ffmpeg import (get_square_region, get_rawvideo_cmd, get_rawvideo_frame_shape,
+                                            read_rawvideo_frames,
+                                            probe_video_stream, get_cached_nframes, set_cached_nframes,
+                                            read_frame, read_frames, get_indexed_nframes, predict_nframes,
+                                            count_nframes_without_decoding)
 from ..misc.time_cost_function import time_it
 from ..misc.waitforbuttonpress_popup import WaitForButtonPressPopup
 from ..processing.semicontrolled_data_cleaning import normalize_signal
@@ -38,6 +42,8 @@ class KinectLEDRegionOfInterest:
         # results
         self.led_in_frame = False
         self.roi = None
+        # True when the area of interest has been written while being extracted
+        self.roi_saved = False
 
     def is_already_processed(self):
         metadata_file = os.path.join(self.result_dir_path, self.result_filename + "_metadata.txt")
@@ -80,9 +86,8 @@ class KinectLEDRegionOfInterest:
             cv2.waitKey(1)
 
         # Display the first frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        ret, first_frame = self.cap.read()
-        if not ret:
+        first_frame = read_frame(self.video_path, 0)
+        if first_frame is None:
             raise Exception("Error: Could not read the first frame.")
 
         display_frame(first_frame, "First Frame")
@@ -118,14 +123,14 @@ class KinectLEDRegionOfInterest:
             return 0  # The first frame was chosen
 
         # Display 19 frames linearly spread over the entire video
-        total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # (the frame index gives the exact number of frames and a direct access to each of them)
+        total_frames = get_indexed_nframes(self.video_path)
         frame_indices = np.linspace(0, total_frames / 2 - 1, 19, dtype=int)
+        frames = read_frames(self.video_path, frame_indices)
 
         miniatures = []
-        for i, frame_idx in enumerate(frame_indices):
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = self.cap.read()
-            if not ret:
+        for frame_idx, frame in zip(frame_indices, frames):
+            if frame is None:
                 continue
             thumbnail = cv2.resize(frame, (160 * 4, 90 * 4))  # Create thumbnail
             miniatures.append((frame_idx, thumbnail))
@@ -175,9 +180,8 @@ class KinectLEDRegionOfInterest:
             return None
 
         # Final confirmation for selected frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, selected_frame_idx)
-        ret, selected_frame = self.cap.read()
-        if not ret:
+        selected_frame = read_frame(self.video_path, selected_frame_idx)
+        if selected_frame is None:
             return False
 
         display_frame(selected_frame, "Selected Frame")
@@ -198,9 +202,8 @@ class KinectLEDRegionOfInterest:
 
     def set_reference_frame(self, frame_idx):
         self.reference_frame_idx = frame_idx
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-        ret, self.reference_frame = self.cap.read()
-        if not ret:
+        self.reference_frame = read_frame(self.video_path, frame_idx)
+        if self.reference_frame is None:
             raise Exception("Error: Could not read the reference frame.")
 
     def draw_square(self, event, x, y, flags, param):
@@ -299,40 +302,43 @@ class KinectLEDRegionOfInterest:
         if not os.path.exists(self.video_path):
             print(f"The video_path does not point on an existing file.")
 
-        cmd = ["ffmpeg", "-i", self.video_path]
-        # COLOR/RGB channels (or stream) in Kinect videos are located in 0
-        probe = subprocess.run([
-            *"ffprobe -v quiet -print_format json -show_format -show_streams".split(),
-            self.video_path
-        ], capture_output=True)
-        probe.check_returncode()
-        stream_rgb = json.loads(probe.stdout)["streams"][0]
+        # the number of frames is already known if the video has been decoded before
+        nframes_cached = get_cached_nframes(self.video_path)
+        if nframes_cached is not None:
+            self.nframes = nframes_cached
+            return
 
+        # COLOR/RGB channels (or stream) in Kinect videos are located in 0
+        stream_rgb = probe_video_stream(self.video_path)
         index = stream_rgb["index"]
-        if stream_rgb["codec_type"] != "video":
-            warnings.warn("PROBLEM: Expected stream for RGB video is not a video")
-        cmd += "-map", f"0:{index}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
 
-        frame_shape = np.array([self.frame_height, self.frame_width, 3])
-        nelem = frame_shape.prod()
+        # the packets of the container give the exact number of frames without decoding the video
+        nframes_counted = count_nframes_without_decoding(self.video_path, index)
+        if nframes_counted is not None:
+            self.nframes = nframes_counted
+            set_cached_nframes(self.video_path, nframes_counted)
+            return
+
+        # otherwise, decode the video to count its frames
+        cmd = get_rawvideo_cmd(self.video_path, index)
+
+        frame_shape = get_rawvideo_frame_shape(self.frame_width, self.frame_height)
         nframes = 0
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
-            while True:
-                data = proc.stdout.read(nelem)  # One byte per each element
-                if not data:
-                    break
-                nframes += 1
-                if (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
-                    print("Create Area of Interest> Progression:", int(progression_list[progression_idx]),
-                          "% ( Frame:",
-                          nframes, "/",
-                          nframes_predicted, ")")
-                    progression_idx += 1
+        for _ in read_rawvideo_frames(cmd, frame_shape):
+            nframes += 1
+            if progression_idx < len(progression_list) and \
+                    (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
+                print("Create Area of Interest> Progression:", int(progression_list[progression_idx]),
+                      "% ( Frame:",
+                      nframes, "/",
+                      nframes_predicted, ")")
+                progression_idx += 1
         # take advantage to store the correct number of frames
         self.nframes = nframes
+        set_cached_nframes(self.video_path, nframes)
 
     @time_it
-    def extract_roi(self):
+    def extract_roi(self, memmap_filename=None, ffmpeg_crop=False, roi_format=None):
         if self.cap is None or self.reference_frame is None:
             raise Exception("Error: Video not initialized. Please call initialise_video() first.")
 
@@ -351,57 +357,117 @@ class KinectLEDRegionOfInterest:
         if not os.path.exists(self.video_path):
             print(f"The video_path does not point on an existing file.")
 
-        cmd = ["ffmpeg", "-i", self.video_path]
         # COLOR/RGB channels (or stream) in Kinect videos are located in 0
-        probe = subprocess.run([
-            *"ffprobe -v quiet -print_format json -show_format -show_streams".split(),
-            self.video_path
-        ], capture_output=True)
-        probe.check_returncode()
-        stream_rgb = json.loads(probe.stdout)["streams"][0]
-
+        stream_rgb = probe_video_stream(self.video_path)
         index = stream_rgb["index"]
-        if stream_rgb["codec_type"] != "video":
-            warnings.warn("PROBLEM: Expected stream for RGB video is not a video")
-        cmd += "-map", f"0:{index}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
 
-        # Clean area of interest variable
-        self.roi = []
+        # the exact number of frames is known if the video has already been decoded, otherwise
+        # ffprobe's estimation is more reliable than cv2's to size the area of interest buffer
+        nframes_cached = get_cached_nframes(self.video_path)
+        if nframes_cached is not None:
+            nframes_predicted = nframes_cached
+        else:
+            nframes_predicted = self.predict_nframes(stream_rgb, default=nframes_predicted)
 
         # Define the square region
-        half_size = self.square_size // 2
-        x_start = max(self.square_center[0] - half_size, 0)
-        x_end = min(self.square_center[0] + half_size, self.frame_width)
-        y_start = max(self.square_center[1] - half_size, 0)
-        y_end = min(self.square_center[1] + half_size, self.frame_height)
-
-        frame_shape = np.array([self.frame_height, self.frame_width, 3])
-        nelem = frame_shape.prod()
+        x_start, x_end, y_start, y_end = get_square_region(self.square_center, self.square_size,
+                                                           self.frame_width, self.frame_height)
+
+        # Preallocate the area of interest (in RAM or on disk) instead of stacking a list of frames
+        roi_shape = (y_end - y_start, x_end - x_start, 3)
+        self.roi = self.allocate_roi(nframes_predicted, roi_shape, memmap_filename)
+        # If roi_format ("mp4" or "npy"), the area of interest is saved by a writer thread while ffmpeg decodes
+        roi_writer = None
+        if roi_format is not None:
+            roi_writer = ThreadedROIWriter(self.create_roi_writer(roi_shape, roi_format))
+
+        # If ffmpeg_crop, the decoder crops the frames itself: only the LED square is piped out of ffmpeg
+        crop_region = (x_start, x_end, y_start, y_end) if ffmpeg_crop else None
+        cmd = get_rawvideo_cmd(self.video_path, index, crop_region=crop_region)
+        frame_shape = get_rawvideo_frame_shape(self.frame_width, self.frame_height, crop_region=crop_region)
         nframes = 0
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
-            while True:
-                data = proc.stdout.read(nelem)  # One byte per each element
-                if not data:
-                    break
+        try:
+            # frame is a view on the reader's buffer: it is copied into the area of interest
+            for frame in read_rawvideo_frames(cmd, frame_shape):
+                if nframes == self.roi.shape[0]:
+                    self.roi = self.grow_roi(self.roi, memmap_filename)
+                if ffmpeg_crop:
+                    self.roi[nframes] = frame
+                else:
+                    self.roi[nframes] = frame[y_start:y_end, x_start:x_end]
+                if roi_writer is not None:
+                    # the stored frame is queued, not the reader's buffer which is overwritten by the next frame
+                    roi_writer.write(self.roi[nframes])
                 nframes += 1
-                frame = np.frombuffer(data, dtype=np.uint8).reshape(frame_shape)
 
-                if (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
-                    print("Create Area of Interest> Progression:", int(progression_list[progression_idx]), "% ( Frame:",
-                          nframes, "/",
-                          nframes_predicted, ")")
+                if progression_idx < len(progression_list) and \
+                        (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
+                    print("Create Area of Interest> Progression:", int(progression_list[progression_idx]),
+                          "% ( Frame:", nframes, "/", nframes_predicted, ")")
                     progression_idx += 1
-                self.roi.append(frame[y_start:y_end, x_start:x_end])
+        finally:
+            if roi_writer is not None:
+                roi_writer.close()
+        self.roi_saved = roi_writer is not None
 
-        # convert into array
-        self.roi = np.array(self.roi)
+        # remove the unused preallocated frames (view, no copy)
+        self.roi = self.roi[:nframes]
         # take advantage to store the correct number of frames
         self.nframes = nframes
-
-    def save_results(self, verbose=False):
+        set_cached_nframes(self.video_path, nframes)
+
+    @staticmethod
+    def predict_nframes(stream, default=0):
+        return predict_nframes(stream, default)
+
+    @staticmethod
+    def allocate_roi(nframes, roi_shape, memmap_filename=None):
+        # a few spare frames avoid growing the array when the prediction is slightly short
+        shape = (max(int(nframes), 1) + 16, *roi_shape)
+        if memmap_filename is None:
+            return np.empty(shape, dtype=np.uint8)
+        return np.memmap(memmap_filename, dtype=np.uint8, mode='w+', shape=shape)
+
+    @staticmethod
+    def grow_roi(roi, memmap_filename=None):
+        # grow by 25% to keep the number of reallocations low
+        nframes_new = roi.shape[0] + max(roi.shape[0] // 4, 1)
+        shape = (nframes_new, *roi.shape[1:])
+        if memmap_filename is None:
+            roi_grown = np.empty(shape, dtype=roi.dtype)
+            roi_grown[:roi.shape[0]] = roi
+            return roi_grown
+        # the file on disk is extended in place, already written frames are kept
+        roi.flush()
+        del roi
+        return np.memmap(memmap_filename, dtype=np.uint8, mode='r+', shape=shape)
+
+    def create_roi_writer(self, roi_shape, roi_format="mp4"):
+        if not os.path.exists(self.result_dir_path):
+            os.makedirs(self.result_dir_path)
+        filename_abspath = os.path.join(self.result_dir_path, self.get_roi_filename(roi_format))
+        if roi_format == "mp4":
+            return ROIVideoWriter(filename_abspath, self.fps, (roi_shape[1], roi_shape[0]))
+        elif roi_format == "npy":
+            return ROIChunkWriter(filename_abspath, self.fps)
+        raise ValueError(f"Unknown ROI format: {roi_format} (expected 'mp4' or 'npy').")
+
+    def get_roi_filename(self, roi_format="mp4"):
+        # mp4: lossy video; npy: lossless directory of .npy chunks of frames
+        if roi_format == "npy":
+            return self.result_filename + "_npy"
+        return self.result_filename + ".mp4"
+
+    def save_results(self, verbose=False, save_video=True, roi_format="mp4"):
         if not os.path.exists(self.result_dir_path):
             os.makedirs(self.result_dir_path)
-        self.save_roi_as_video(self.result_dir_path, self.result_filename + ".mp4")
+        # the ROI video is not needed when the LED blinking is extracted from the source video in one pass,
+        # and it is already written if it has been saved during the extraction
+        if save_video and not self.roi_saved:
+            if roi_format == "npy":
+                self.save_roi_as_chunks(self.result_dir_path, self.get_roi_filename(roi_format))
+            else:
+                self.save_roi_as_video(self.result_dir_path, self.get_roi_filename(roi_format))
         self.save_result_metadata(self.result_dir_path, self.result_filename + "_metadata.txt")
         if verbose:
             print(f"Results saved as {self.result_dir_path}{self.result_filename}*.")
@@ -415,9 +481,8 @@ class KinectLEDRegionOfInterest:
 
         filename_abspath = os.path.join(output_path, filename)
 
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
         size = (self.roi.shape[2], self.roi.shape[1])
-        out = cv2.VideoWriter(filename_abspath, fourcc, self.fps, size)
+        out = ROIVideoWriter(filename_abspath, self.fps, size)
         for frame in self.roi:
             out.write(frame)
 
@@ -425,9 +490,21 @@ class KinectLEDRegionOfInterest:
                 cv2.imshow('frame', frame)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
-        out.release()
+        out.close()
         cv2.destroyAllWindows()
 
+    def save_roi_as_chunks(self, output_path, dirname):
+        if self.roi is None:
+            if not self.led_in_frame:
+                return
+            else:
+                raise Exception("Error: roi not extracted.")
+
+        out = ROIChunkWriter(os.path.join(output_path, dirname), self.fps)
+        for frame in self.roi:
+            out.write(frame)
+        out.close()
+
     def save_result_metadata(self, output_path, filename):
         if self.reference_frame_idx is None:
             self.reference_frame_idx = -1
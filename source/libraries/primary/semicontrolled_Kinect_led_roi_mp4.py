@@ -8,6 +8,8 @@ import matplotlib.pyplot as plt
 import warnings
 
 from .semicontrolled_Kinect_led_roi import KinectLEDRegionOfInterest
+from .semicontrolled_Kinect_roi_writer import ThreadedROIWriter
+from .semicontrolled_Kinect_ffmpeg import get_cached_nframes, set_cached_nframes
 from ..misc.time_cost_function import time_it
 from ..misc.waitforbuttonpress_popup import WaitForButtonPressPopup
 from ..processing.semicontrolled_data_cleaning import normalize_signal
@@ -29,6 +31,13 @@ class KinectLEDRegionOfInterestMP4(KinectLEDRegionOfInterest):
             print("The video_path does not point to an existing file.")
             return
 
+        # the number of frames is already known if the video has been decoded before
+        nframes_cached = get_cached_nframes(self.video_path)
+        if nframes_cached is not None:
+            self.cap.release()
+            self.nframes = nframes_cached
+            return
+
         # Re-initialize video capture
         self.cap = cv2.VideoCapture(self.video_path)
         if not self.cap.isOpened():
@@ -45,7 +54,8 @@ class KinectLEDRegionOfInterestMP4(KinectLEDRegionOfInterest):
 
             nframes += 1
 
-            if (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
+            if progression_idx < len(progression_list) and \
+                    (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
                 print("Create Area of Interest> Progression:", int(progression_list[progression_idx]),
                       "% ( Frame:", nframes, "/", nframes_predicted, ")")
                 progression_idx += 1
@@ -55,9 +65,10 @@ class KinectLEDRegionOfInterestMP4(KinectLEDRegionOfInterest):
 
         # Store the correct number of frames
         self.nframes = nframes
+        set_cached_nframes(self.video_path, nframes)
 
     @time_it
-    def extract_roi(self):
+    def extract_roi(self, memmap_filename=None, roi_format=None):
         # Check if the video is initialized
         if self.cap is None or self.reference_frame is None:
             raise Exception("Error: Video not initialized. Please call initialise_video() first.")
@@ -72,9 +83,6 @@ class KinectLEDRegionOfInterestMP4(KinectLEDRegionOfInterest):
         progression_idx = 0
         nframes = 0
 
-        # Clean area of interest variable
-        self.roi = []
-
         # Define the square region
         half_size = self.square_size // 2
         x_start = max(self.square_center[0] - half_size, 0)
@@ -82,25 +90,42 @@ class KinectLEDRegionOfInterestMP4(KinectLEDRegionOfInterest):
         y_start = max(self.square_center[1] - half_size, 0)
         y_end = min(self.square_center[1] + half_size, self.frame_height)
 
-        # Start reading frames
-        while True:
-            ret, frame = self.cap.read()
-            if not ret:
-                break
-            nframes += 1
-
-            # Extract the region of interest
-            roi_frame = frame[y_start:y_end, x_start:x_end]
-            self.roi.append(roi_frame)
+        # Preallocate the area of interest (in RAM or on disk) instead of stacking a list of frames
+        roi_shape = (y_end - y_start, x_end - x_start, 3)
+        self.roi = self.allocate_roi(nframes_predicted, roi_shape, memmap_filename)
+        # If roi_format ("mp4" or "npy"), the area of interest is saved by a writer thread while cv2 decodes
+        roi_writer = None
+        if roi_format is not None:
+            roi_writer = ThreadedROIWriter(self.create_roi_writer(roi_shape, roi_format))
 
-            # Display progress
-            if (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
-                print("Create Area of Interest> Progression:", int(progression_list[progression_idx]), "% ( Frame:",
-                      nframes, "/", nframes_predicted, ")")
-                progression_idx += 1
-
-        # Convert the list of ROIs to a numpy array
-        self.roi = np.array(self.roi)
+        # Start reading frames
+        try:
+            while True:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+
+                # Extract the region of interest
+                if nframes == self.roi.shape[0]:
+                    self.roi = self.grow_roi(self.roi, memmap_filename)
+                self.roi[nframes] = frame[y_start:y_end, x_start:x_end]
+                if roi_writer is not None:
+                    roi_writer.write(self.roi[nframes])
+                nframes += 1
+
+                # Display progress
+                if progression_idx < len(progression_list) and \
+                        (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
+                    print("Create Area of Interest> Progression:", int(progression_list[progression_idx]),
+                          "% ( Frame:", nframes, "/", nframes_predicted, ")")
+                    progression_idx += 1
+        finally:
+            if roi_writer is not None:
+                roi_writer.close()
+        self.roi_saved = roi_writer is not None
+
+        # Remove the unused preallocated frames (view, no copy)
+        self.roi = self.roi[:nframes]
 
         # Store the number of frames processed
         self.nframes = nframes
@@ -5,9 +5,11 @@ import csv
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import subprocess
-import warnings
 
+from .semicontrolled_Kinect_ffmpeg import (get_rawvideo_cmd, get_rawvideo_frame_shape, read_rawvideo_frames,
+                                            probe_video_stream, get_cached_nframes, set_cached_nframes,
+                                            read_frame, read_frames, get_indexed_nframes,
+                                            count_nframes_without_decoding)
 from ..misc.time_cost_function import time_it
 from ..misc.waitforbuttonpress_popup import WaitForButtonPressPopup
 from ..processing.semicontrolled_data_cleaning import normalize_signal
@@ -79,9 +81,8 @@ class KinectRegionOfInterest:
             cv2.waitKey(1)
 
         # Display the first frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        ret, first_frame = self.cap.read()
-        if not ret:
+        first_frame = read_frame(self.video_path, 0)
+        if first_frame is None:
             raise Exception("Error: Could not read the first frame.")
 
         display_frame(first_frame, "First Frame")
@@ -117,14 +118,14 @@ class KinectRegionOfInterest:
             return 0  # The first frame was chosen
 
         # Display 19 frames linearly spread over the entire video
-        total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # (the frame index gives the exact number of frames and a direct access to each of them)
+        total_frames = get_indexed_nframes(self.video_path)
         frame_indices = np.linspace(0, total_frames / 2 - 1, 19, dtype=int)
+        frames = read_frames(self.video_path, frame_indices)
 
         miniatures = []
-        for i, frame_idx in enumerate(frame_indices):
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = self.cap.read()
-            if not ret:
+        for frame_idx, frame in zip(frame_indices, frames):
+            if frame is None:
                 continue
             thumbnail = cv2.resize(frame, (160 * 4, 90 * 4))  # Create thumbnail
             miniatures.append((frame_idx, thumbnail))
@@ -174,9 +175,8 @@ class KinectRegionOfInterest:
             return None
 
         # Final confirmation for selected frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, selected_frame_idx)
-        ret, selected_frame = self.cap.read()
-        if not ret:
+        selected_frame = read_frame(self.video_path, selected_frame_idx)
+        if selected_frame is None:
             return False
 
         display_frame(selected_frame, "Selected Frame")
@@ -197,9 +197,8 @@ class KinectRegionOfInterest:
 
     def set_reference_frame(self, frame_idx):
         self.reference_frame_idx = frame_idx
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-        ret, self.reference_frame = self.cap.read()
-        if not ret:
+        self.reference_frame = read_frame(self.video_path, frame_idx)
+        if self.reference_frame is None:
             raise Exception("Error: Could not read the reference frame.")
 
     def draw_rectangle(self, event, x, y, flags, param):
@@ -294,37 +293,40 @@ class KinectRegionOfInterest:
         if not os.path.exists(self.video_path):
             print(f"The video_path does not point on an existing file.")
 
-        cmd = ["ffmpeg", "-i", self.video_path]
-        # COLOR/RGB channels (or stream) in Kinect videos are located in 0
-        probe = subprocess.run([
-            *"ffprobe -v quiet -print_format json -show_format -show_streams".split(),
-            self.video_path
-        ], capture_output=True)
-        probe.check_returncode()
-        stream_rgb = json.loads(probe.stdout)["streams"][0]
+        # the number of frames is already known if the video has been decoded before
+        nframes_cached = get_cached_nframes(self.video_path)
+        if nframes_cached is not None:
+            self.nframes = nframes_cached
+            return
 
+        # COLOR/RGB channels (or stream) in Kinect videos are located in 0
+        stream_rgb = probe_video_stream(self.video_path)
         index = stream_rgb["index"]
-        if stream_rgb["codec_type"] != "video":
-            warnings.warn("PROBLEM: Expected stream for RGB video is not a video")
-        cmd += "-map", f"0:{index}", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
 
-        frame_shape = np.array([self.frame_height, self.frame_width, 3])
-        nelem = frame_shape.prod()
+        # the packets of the container give the exact number of frames without decoding the video
+        nframes_counted = count_nframes_without_decoding(self.video_path, index)
+        if nframes_counted is not None:
+            self.nframes = nframes_counted
+            set_cached_nframes(self.video_path, nframes_counted)
+            return
+
+        # otherwise, decode the video to count its frames
+        cmd = get_rawvideo_cmd(self.video_path, index)
+
+        frame_shape = get_rawvideo_frame_shape(self.frame_width, self.frame_height)
         nframes = 0
-        with subprocess.Popen(cmd, stdout=subprocess.PIPE) as proc:
-            while True:
-                data = proc.stdout.read(nelem)  # One byte per each element
-                if not data:
-                    break
-                nframes += 1
-                if (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
-                    print("Create Area of Interest> Progression:", int(progression_list[progression_idx]),
-                          "% ( Frame:",
-                          nframes, "/",
-                          nframes_predicted, ")")
-                    progression_idx += 1
+        for _ in read_rawvideo_frames(cmd, frame_shape):
+            nframes += 1
+            if progression_idx < len(progression_list) and \
+                    (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
+                print("Create Area of Interest> Progression:", int(progression_list[progression_idx]),
+                      "% ( Frame:",
+                      nframes, "/",
+                      nframes_predicted, ")")
+                progression_idx += 1
         # take advantage to store the correct number of frames
         self.nframes = nframes
+        set_cached_nframes(self.video_path, nframes)
 
     def save_result(self, verbose=False):
         if self.reference_frame_idx is None:
@@ -0,0 +1,125 @@
+import cv2
+import glob
+import json
+import numpy as np
+import os
+import queue
+import threading
+
+
+# Name of the file storing the video properties in a directory of ROI chunks
+ROI_CHUNKS_INFO_FILENAME = "roi_info.json"
+
+
+class ROIVideoWriter:
+    # Area of interest saved as a mp4 video (lossy)
+    def __init__(self, filename_abspath, fps, frame_size):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.out = cv2.VideoWriter(filename_abspath, fourcc, fps, frame_size)
+        if not self.out.isOpened():
+            raise Exception(f"Error: Could not open the video writer <{filename_abspath}>.")
+
+    def write(self, frame):
+        self.out.write(np.ascontiguousarray(frame))
+
+    def close(self):
+        self.out.release()
+
+
+class ROIChunkWriter:
+    # Area of interest saved without loss as a directory of .npy files of chunk_size frames each
+    # (faster to write and to read than a video, and a few MB only for the LED square)
+    def __init__(self, dirname_abspath, fps, chunk_size=4096):
+        self.dirname = dirname_abspath
+        self.fps = fps
+        self.chunk_size = chunk_size
+        self.buffer = None
+        self.nbuffered = 0
+        self.nchunks = 0
+        self.nframes = 0
+
+        os.makedirs(self.dirname, exist_ok=True)
+        # remove the chunks of a previous extraction
+        for filename in glob.glob(os.path.join(self.dirname, "chunk_*.npy")):
+            os.remove(filename)
+
+    def write(self, frame):
+        if self.buffer is None:
+            self.buffer = np.empty((self.chunk_size, *frame.shape), dtype=frame.dtype)
+        self.buffer[self.nbuffered] = frame
+        self.nbuffered += 1
+        self.nframes += 1
+        if self.nbuffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.nbuffered:
+            return
+        np.save(os.path.join(self.dirname, f"chunk_{self.nchunks:05d}.npy"), self.buffer[:self.nbuffered])
+        self.nchunks += 1
+        self.nbuffered = 0
+
+    def close(self):
+        self.flush()
+        info = {"fps": self.fps, "nframes": self.nframes, "nchunks": self.nchunks}
+        with open(os.path.join(self.dirname, ROI_CHUNKS_INFO_FILENAME), 'w') as f:
+            json.dump(info, f, indent=4)
+
+
+class ThreadedROIWriter:
+    # Wraps a writer so that the frames are encoded/written by a separate thread while the caller
+    # keeps decoding. The queue is bounded: the memory stays low if the writer is the slowest.
+    def __init__(self, writer, maxsize=256):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            # after an error, the queue is still emptied so that the producer is never blocked
+            if self.error is not None:
+                continue
+            try:
+                self.writer.write(frame)
+            except Exception as e:
+                self.error = e
+
+    def write(self, frame):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(frame)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def load_roi_chunks(dirname_abspath):
+    # Read back a directory written by ROIChunkWriter: (frames, fps)
+    with open(os.path.join(dirname_abspath, ROI_CHUNKS_INFO_FILENAME), 'r') as f:
+        info = json.load(f)
+    filenames = [os.path.join(dirname_abspath, f"chunk_{idx:05d}.npy") for idx in range(info["nchunks"])]
+    if not filenames:
+        return np.zeros((0, 0, 0, 3), dtype=np.uint8), info["fps"]
+    # allocate once and read each chunk in place
+    chunks = [np.load(filename, mmap_mode='r') for filename in filenames]
+    frames = np.empty((info["nframes"], *chunks[0].shape[1:]), dtype=chunks[0].dtype)
+    idx = 0
+    for chunk in chunks:
+        frames[idx:idx + len(chunk)] = chunk
+        idx += len(chunk)
+    return frames, info["fps"]
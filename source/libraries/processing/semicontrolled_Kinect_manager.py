@@ -4,11 +4,17 @@ import json
 import matplotlib.pyplot as plt
 import numpy as np
 import os
-import pandas as pd
 
 from ..misc.time_cost_function import time_it
+from ..primary.semicontrolled_Kinect_led_blinking import (accumulate_occlusion_statistics, compute_occlusion,
+                                                         compute_green_levels, iterate_chunks)
+from ..primary.semicontrolled_Kinect_ffmpeg import (read_frame, read_frames, get_indexed_nframes, get_square_region,
+                                                    get_rawvideo_cmd, get_rawvideo_frame_shape, read_rawvideo_frames,
+                                                    probe_video_stream, get_cached_nframes, set_cached_nframes,
+                                                    predict_nframes)
 from ..misc.waitforbuttonpress_popup import WaitForButtonPressPopup
 from .semicontrolled_data_cleaning import normalize_signal
+from ..materials.kinect_led import save_led_timeseries_npz, read_led_timeseries
 
 
 # Class to extract the LED green value of videos
@@ -38,6 +44,10 @@ class ProcessKinectLED:
         self.led_in_frame = None
         self.threshold_value = None
         self.aoi = None  # Area of Interest
+        # computed on the fly by extract_aoi (raw green levels and sum of the pixel values of each frame)
+        self.aoi_green_levels = None
+        self.aoi_frame_sums = None
+        self.aoi_npixels = None
         self.occluded = []
         self.green_levels = []
         self.led_on = []
@@ -68,9 +78,8 @@ class ProcessKinectLED:
     # Method to define the reference frame by frame index
     def define_reference_frame(self, frame_idx):
         self.reference_frame_idx = frame_idx
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-        ret, self.reference_frame = self.cap.read()
-        if not ret:
+        self.reference_frame = read_frame(self.video_path, frame_idx)
+        if self.reference_frame is None:
             raise Exception("Error: Could not read the first frame.")
 
     # Method to select a good frame from the video
@@ -83,9 +92,8 @@ class ProcessKinectLED:
             cv2.waitKey(1)
 
         # Display the first frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        ret, first_frame = self.cap.read()
-        if not ret:
+        first_frame = read_frame(self.video_path, 0)
+        if first_frame is None:
             raise Exception("Error: Could not read the first frame.")
 
         display_frame(first_frame, "First Frame")
@@ -120,14 +128,14 @@ class ProcessKinectLED:
             return 0  # The first frame was chosen
 
         # Display 19 frames linearly spread over the entire video
-        total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # (the frame index gives the exact number of frames and a direct access to each of them)
+        total_frames = get_indexed_nframes(self.video_path)
         frame_indices = np.linspace(0, total_frames / 2 - 1, 19, dtype=int)
+        frames = read_frames(self.video_path, frame_indices)
 
         miniatures = []
-        for i, frame_idx in enumerate(frame_indices):
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-            ret, frame = self.cap.read()
-            if not ret:
+        for frame_idx, frame in zip(frame_indices, frames):
+            if frame is None:
                 continue
             thumbnail = cv2.resize(frame, (160 * 4, 90 * 4))  # Create thumbnail
             miniatures.append((frame_idx, thumbnail))
@@ -175,9 +183,8 @@ class ProcessKinectLED:
             return None
 
         # Final confirmation for selected frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, selected_frame_idx)
-        ret, selected_frame = self.cap.read()
-        if not ret:
+        selected_frame = read_frame(self.video_path, selected_frame_idx)
+        if selected_frame is None:
             return False
 
         display_frame(selected_frame, "Selected Frame")
@@ -273,57 +280,80 @@ class ProcessKinectLED:
         return [self.square_center, self.square_size]
 
     @time_it
-    def extract_aoi(self):
+    def extract_aoi(self, keep_aoi=False, chunk_size=4096):
         if self.cap is None or self.reference_frame is None:
             raise Exception("Error: Video not initialized. Please call initialise() first.")
 
-        # Reset the area of interest
-        self.aoi = []
+        # CV2 read tends to sometimes not fully scan the video, hence the video is streamed with ffmpeg:
+        # the decoder crops the square region (BGR, as cv2) and the green levels and the sums of the pixel
+        # values (occlusion) are computed on the fly, by chunks of frames.
+        # The frames are not kept by default: the memory is bounded by chunk_size. If keep_aoi (needed to display
+        # the frames, or to compute the occlusion pixel-wise), they are written in place in a preallocated array
+        # (one stack of frames in memory).
+        self.cap.release()
 
-        # Define the square region
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        _, frame = self.cap.read()
-        half_size = self.square_size // 2
-        x_start = max(self.square_center[0] - half_size, 0)
-        x_end = min(self.square_center[0] + half_size, frame.shape[1])
-        y_start = max(self.square_center[1] - half_size, 0)
-        y_end = min(self.square_center[1] + half_size, frame.shape[0])
+        stream = probe_video_stream(self.video_path)
+        frame_width = stream["width"]
+        frame_height = stream["height"]
+        crop_region = get_square_region(self.square_center, self.square_size, frame_width, frame_height)
+        cmd = get_rawvideo_cmd(self.video_path, stream["index"], crop_region=crop_region, pix_fmt="bgr24")
+        frame_shape = get_rawvideo_frame_shape(frame_width, frame_height, crop_region=crop_region)
 
         # Variables for progression and frame counting
-        nframes_predicted = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        nframes_predicted = get_cached_nframes(self.video_path)
+        if nframes_predicted is None:
+            nframes_predicted = max(predict_nframes(stream, default=1), 1)
         progression_list = np.linspace(0, 100, 20)
         progression_idx = 0
         nframes = 0
 
-        # Reset to the first frame
-        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
-        # Extract the square region
-        while self.cap.isOpened():
-            correctly_read, frame = self.cap.read()
-            if not correctly_read:
-                break
-            nframes += 1
-            if (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
+        aoi = np.empty((nframes_predicted if keep_aoi else 0, *frame_shape), dtype=np.uint8)
+        green_levels = []
+        frame_sums = []
+        for chunk in iterate_chunks(read_rawvideo_frames(cmd, frame_shape), chunk_size):
+            green_levels.append(compute_green_levels(chunk, self.lower_green, self.upper_green))
+            frame_sums.append(chunk.reshape(len(chunk), -1).sum(axis=1, dtype=np.int64))
+            if keep_aoi:
+                if nframes + len(chunk) > len(aoi):
+                    # more frames than predicted: grow the array (doubling, so that it rarely happens twice)
+                    aoi_grown = np.empty((max(2 * len(aoi), nframes + len(chunk)), *frame_shape), dtype=np.uint8)
+                    aoi_grown[:nframes] = aoi[:nframes]
+                    aoi = aoi_grown
+                # the chunk buffer is reused by the next chunk: copied in place
+                aoi[nframes:nframes + len(chunk)] = chunk
+            nframes += len(chunk)
+            while progression_idx < len(progression_list) and \
+                    (100 * nframes / nframes_predicted) > progression_list[progression_idx]:
                 print("Create Area of Interest> Progression:", int(progression_list[progression_idx]), "% ( Frame:",
                       nframes, "/",
                       nframes_predicted, ")")
                 progression_idx += 1
-            self.aoi.append(frame[y_start:y_end, x_start:x_end])
 
-        # convert into array
-        self.aoi = np.array(self.aoi)
+        self.aoi_green_levels = np.concatenate(green_levels) if len(green_levels) else np.zeros(0)
+        self.aoi_frame_sums = np.concatenate(frame_sums) if len(frame_sums) else np.zeros(0, dtype=np.int64)
+        self.aoi_npixels = int(np.prod(frame_shape))
+        if keep_aoi:
+            # remove the unused preallocated frames (view, no copy)
+            self.aoi = aoi[:nframes]
+        else:
+            self.aoi = None
 
         # take advantage to store the correct number of frames
         self.nframes = nframes
-
-        self.cap.release()
+        set_cached_nframes(self.video_path, nframes)
 
     # Method to monitor green levels in the selected area
     @time_it
     def monitor_green_levels(self, show=False):
+        # the green levels have already been computed while decoding the video (extract_aoi)
+        if self.aoi_green_levels is not None and not show:
+            self.green_levels = normalize_signal(self.aoi_green_levels, dtype=np.ndarray)
+            self.time = np.linspace(0, 1 / self.fps * (self.nframes - 1), self.nframes)
+            return
+
         if self.aoi is None:
-            raise Exception("Error: Area of Interest was not initialized. Please call extract_aoi() first.")
+            raise Exception("Error: Area of Interest was not initialized. "
+                            "Please call extract_aoi(keep_aoi=True) first.")
 
         self.green_levels = np.zeros(self.nframes)
 
@@ -368,34 +398,27 @@ class ProcessKinectLED:
 
         self.led_on[led_on_idx] = 1
 
-    def define_occlusion(self, threshold=40, show=False):
-        if self.aoi is None or self.led_on is None:
+    def define_occlusion(self, threshold=40, show=False, frames=None, chunk_size=4096):
+        # frames can be any iterable of AOI frames (e.g. frames streamed from the decoder),
+        # so that occlusion is computed without keeping the AOI stack in memory
+        if frames is None:
+            frames = self.aoi
+        if self.led_on is None or (frames is None and self.aoi_frame_sums is None):
             raise Exception("Error: led_on was not initialized. Please call monitor_green_levels().")
 
-        # initialise occluded variable
-        self.occluded = np.full(self.nframes, False, dtype=bool)
-
-        frame_avg_off_idx = np.where(self.led_on == False)[0]
-        frame_avg_on_idx = np.where(self.led_on == True)[0]
-
-        frame_avg_off = np.round(np.mean(self.aoi[frame_avg_off_idx, :, :, :], axis=0)).astype(int)
-        frame_avg_on = np.round(np.mean(self.aoi[frame_avg_on_idx, :, :, :], axis=0)).astype(int)
-
-        means_off = []
-        means_on = []
-
-        for idx, frame in enumerate(self.aoi):
-            frame_off = np.subtract(frame, frame_avg_off)
-            frame_on = np.subtract(frame, frame_avg_on)
-
-            mean_off = abs(np.mean(frame_off))
-            mean_on = abs(np.mean(frame_on))
-
-            means_off.append(mean_off)
-            means_on.append(mean_on)
-
-            if not (mean_off < threshold) or not (mean_on < threshold):
-                self.occluded[idx] = True
+        if frames is not None:
+            # per-frame distances to the average LED OFF/ON frames, computed by chunks of frames
+            frame_sums, npixels, stats_off, stats_on = accumulate_occlusion_statistics(frames, self.led_on,
+                                                                                      chunk_size)
+        else:
+            # the frames have not been kept (extract_aoi, keep_aoi=False): the sums of the average LED OFF/ON
+            # frames are estimated from the frame sums (no pixel-wise rounding)
+            led_on = np.asarray(self.led_on)
+            frame_sums = self.aoi_frame_sums
+            npixels = self.aoi_npixels
+            stats_off = (frame_sums[led_on == 0].sum(), np.count_nonzero(led_on == 0))
+            stats_on = (frame_sums[led_on == 1].sum(), np.count_nonzero(led_on == 1))
+        self.occluded, means_off, means_on = compute_occlusion(frame_sums, npixels, stats_off, stats_on, threshold)
 
         if show:
             fig, axs = plt.subplots(3, 1, sharex=True)
@@ -424,7 +447,7 @@ class ProcessKinectLED:
             plt.close()
 
             for idx, occlusion in enumerate(self.occluded):
-                if occlusion:
+                if occlusion and self.aoi is not None:
                     plt.imshow(self.aoi[idx, :, :, :])
                     plt.ion()
                     plt.draw()
@@ -481,12 +504,12 @@ class ProcessKinectLED:
     # Method to load previously saved results
     def load_results(self, dropna=False):
         csv_file = os.path.join(self.result_dir_path, self.result_file_name + ".csv")
-        df = pd.read_csv(csv_file)
+        df = read_led_timeseries(csv_file)
         if dropna:
             df.dropna(inplace=True)
         self.time = [round(num, 5) for num in df["time (second)"].values]
         self.green_levels = [round(num, 5) for num in df["green level"].values]
-        self.led_on = df["LED on"].values
+        self.led_on = df["LED on"].to_numpy(dtype=np.float64)  # float: the occluded frames are set to NaN
 
         metadata_file = os.path.join(self.result_dir_path, self.result_file_name + "_metadata.txt")
         with open(metadata_file, 'r') as jsonfile:
@@ -505,7 +528,7 @@ class ProcessKinectLED:
             self.nframes = data.get("nframes", 0)
             self.fourcc_str = data.get("fourcc_str", "")
 
-    def save_results(self):
+    def save_results(self, save_npz=True):
         if not os.path.exists(self.result_dir_path):
             os.makedirs(self.result_dir_path)
             print(f"Directory '{self.result_file_name}' created.")
@@ -513,6 +536,9 @@ class ProcessKinectLED:
             print(f"Directory '{self.result_file_name}' already exists.")
 
         self.save_result_csv(self.result_dir_path, self.result_file_name + ".csv")
+        # columnar binary copy of the csv file, faster to load for the next steps
+        if save_npz:
+            self.save_result_npz(self.result_dir_path, self.result_file_name + ".npz")
         self.save_result_metadata(self.result_dir_path, self.result_file_name + "_metadata.txt")
 
     def save_result_csv(self, file_path, file_name):
@@ -523,6 +549,9 @@ class ProcessKinectLED:
             for t_value, green_value, led_value in zip(self.time, self.green_levels, self.led_on):
                 writer.writerow([t_value, green_value, led_value])
 
+    def save_result_npz(self, file_path, file_name):
+        save_led_timeseries_npz(os.path.join(file_path, file_name), self.time, self.green_levels, self.led_on)
+
     def save_result_metadata(self, file_path, file_name):
         full_path = os.path.join(file_path, file_name)
 
@@ -113,49 +113,54 @@ def smooth_scd_signal(sig, scd, nframe=5, method="blind", normalise=True):
 def smooth_signal(sig, window_size=5, normalise=True):
     if not len(sig):
         return sig
-    
-    orig_settings = np.seterr(all='raise')
-
-    # Create a function to handle NaN values
-    def nan_convolve(signal, weights):
-        half_window = len(weights) // 2
-        sig_padded = np.pad(signal, (half_window, half_window), mode='constant', constant_values=np.nan)
-        smoothed = np.full_like(signal, np.nan)
-        for i in range(len(signal)):
-            window = sig_padded[i:i + len(weights)]
-            smoothed_local = window * weights
-
-            if np.all(np.isnan(smoothed_local)):
-                smoothed[i] = np.nan
-            else:
-                smoothed[i] = np.nanmean(window * weights)
-        return smoothed
-
-    if window_size > len(sig):
-        warnings.warn("window_size is longer than sig, shorten it to the signal's length...")
-        window_size = len(sig)
 
-    weights = np.repeat(1.0, window_size) / window_size
+    # floating point errors raise only within this call (local to the thread, unlike np.seterr)
+    with np.errstate(all='raise'):
+        if window_size > len(sig):
+            warnings.warn("window_size is longer than sig, shorten it to the signal's length...")
+            window_size = len(sig)
 
-    if np.isnan(sig).any():
-        sig_output = nan_convolve(sig, weights)
-    else:
-        sig_output = np.convolve(sig, weights, 'same')
+        if np.isnan(sig).any():
+            sig_output = nan_moving_average(sig, window_size)
+        else:
+            weights = np.repeat(1.0, window_size) / window_size
+            sig_output = np.convolve(sig, weights, 'same')
 
-    if len(sig_output) != len(sig):
-        warnings.warn("sig_smooth is not the size of the original signal")
+        if len(sig_output) != len(sig):
+            warnings.warn("sig_smooth is not the size of the original signal")
 
-    if normalise:
-        sig_output = normalize_signal(sig_output)
+        if normalise:
+            sig_output = normalize_signal(sig_output)
 
     # ensure the output is an array
     sig_output = np.array(sig_output)
 
-    np.seterr(**orig_settings)  # restore original
-
     return sig_output
 
 
+def nan_moving_average(sig, window_size):
+    # Moving average that ignores the NaN values, in O(N) from the cumulative sums of the valid values
+    # and of their count. Same output as the former sample by sample loop: for each sample, the window
+    # starts window_size // 2 samples before it (NaN outside of the signal), the output is the nanmean of
+    # window * weights (weights = 1 / window_size), and NaN when the window only contains NaN values.
+    sig = np.asarray(sig, dtype=np.float64)
+    nsamples = len(sig)
+    valid = ~np.isnan(sig)
+    cumsum = np.concatenate(([0.0], np.cumsum(np.where(valid, sig, 0.0))))
+    count = np.concatenate(([0], np.cumsum(valid)))
+
+    start = np.arange(nsamples) - window_size // 2
+    stop = np.clip(start + window_size, 0, nsamples)
+    start = np.clip(start, 0, nsamples)
+    window_sum = cumsum[stop] - cumsum[start]
+    window_count = count[stop] - count[start]
+
+    smoothed = np.full(nsamples, np.nan)
+    has_values = window_count > 0
+    smoothed[has_values] = window_sum[has_values] / window_count[has_values] / window_size
+    return smoothed
+
+
 def normalize_signal(signal, dtype=list):
     if not len(signal):
         if dtype == np.ndarray:
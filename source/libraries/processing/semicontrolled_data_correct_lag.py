@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 import warnings
 
 from .semicontrolled_data_cleaning import smooth_scd_signal, normalize_signal, gaussian_envelope
+from .semicontrolled_signal_lag import cross_correlation_window_batch
 from ..materials.neuraldata import NeuralData  # noqa: E402
 from ..materials.semicontrolled_data import SemiControlledData  # noqa: E402
 from ..plot.semicontrolled_data_visualizer import SemiControlledDataVisualizer  # noqa: E402
@@ -21,30 +22,39 @@ class SemiControlledCorrectLag:
 
         min_delay = -500  # in number of sample (approx 500 ms at 1 kHz)
         max_delay = 500
-        best_lags = [[None for j in range(min_delay, max_delay+1)] for i in range(len(data_trials_in))]
 
-        scd_lag = SemiControlledCorrectLag()
-        for idx, scd in enumerate(data_trials_in):
-            scd_lag.load(scd)
-            best_lags[idx][:], _ = scd_lag.correct_alignment(min_delay, max_delay, show=show)
-        best_lag = np.median(best_lags)
+        # correlations of all the trials for the lags of the window only: 2D array (trials, lags)
+        correlations, lags = self.compute_cross_correlations_window(data_trials_in, min_delay, max_delay)
+        # the trials with a flat correlation (constant/NaN signals, e.g. no spike) have no best lag:
+        # their argmax (first lag of the window) would bias the median
+        valid_rows = rows_with_range(correlations)
+        best_lags = lags[np.nanargmax(correlations[valid_rows], axis=1)]
+        best_lag = np.median(best_lags) if len(best_lags) else 0
+        # normalise the correlation of each trial (heatmap)
+        correlations = normalize_rows(correlations)
+
+        if show:
+            scd_lag = SemiControlledCorrectLag()
+            for scd in data_trials_in:
+                scd_lag.load(scd)
+                scd_lag.correct_alignment(min_delay, max_delay, show=show)
 
         #if show:
         if True:
-            corr_avg = np.mean(best_lags, axis=0)
+            corr_avg = np.mean(correlations, axis=0)
             # Set custom x-axis tick positions and labels
             x_labels = [str(int(num)) for num in np.linspace(min_delay, max_delay, 10)]
-            x_labels_loc = np.linspace(0, len(best_lags[0]), len(x_labels))
+            x_labels_loc = np.linspace(0, correlations.shape[1], len(x_labels))
 
             # Create subplots
             fig, axs = plt.subplots(2, 1, figsize=(8, 6))  # 2 rows, 1 column
             # Plot heatmap on the top subplot
-            axs[0].imshow(oversample_matrix(best_lags, np.shape(best_lags,)[1]), cmap='hot', interpolation='nearest')
+            axs[0].imshow(oversample_matrix(correlations, correlations.shape[1]), cmap='hot', interpolation='nearest')
             axs[0].set_title('2D Array Heatmap')
             axs[0].set_xlabel('Columns')
             axs[0].set_ylabel('Rows')
             axs[0].set_xticks(x_labels_loc, x_labels)  # Set x ticks to match number of columns
-            #fig.colorbar(axs[0].imshow(best_lags, cmap='hot', interpolation='nearest'), ax=axs[0])
+            #fig.colorbar(axs[0].imshow(correlations, cmap='hot', interpolation='nearest'), ax=axs[0])
 
             # Plot column averages on the bottom subplot
             axs[1].plot(corr_avg, marker='o', linestyle='-')
@@ -89,14 +99,30 @@ class SemiControlledCorrectLag:
         contact_flag = (depth > 0).astype(int)
         return contact_flag
 
-    def compute_cross_correlation(self, neural, contact):
-        # Compute cross-correlation
+    def compute_cross_correlation(self, neural, contact, min_lag=None, max_lag=None):
+        # Compute cross-correlation (only for the lags min_lag..max_lag if given)
+        if min_lag is not None and max_lag is not None:
+            correlation, lags = cross_correlation_window_batch([contact], [neural], min_lag, max_lag)
+            return correlation[0], lags
         correlation = correlate(contact, neural, mode='full')
         lags = np.arange(-len(neural) + 1, len(neural))
         if len(correlation) != len(lags):
             warnings.warn("Correlation is not the same size as Lags")
         return correlation, lags
 
+    def compute_cross_correlations_window(self, data_trials, min_lag, max_lag):
+        # Cross-correlation of the contact and neural signals of each trial for the lags min_lag..max_lag,
+        # batched across the trials: (correlations (ntrials, nlags), lags)
+        neural_sigs = []
+        contact_sigs = []
+        scd_lag = SemiControlledCorrectLag()
+        for scd in data_trials:
+            scd_lag.load(scd)
+            neural_sig, contact_sig = scd_lag.prepare_signals()
+            neural_sigs.append(neural_sig)
+            contact_sigs.append(contact_sig)
+        return cross_correlation_window_batch(contact_sigs, neural_sigs, min_lag, max_lag)
+
     def find_best_lag(self, correlation, lags, min_lag=float('-inf'), max_lag=float('inf')):
         valid_indices = np.where((lags >= min_lag) & (lags <= max_lag))[0]
         valid_correlation = correlation[valid_indices]
@@ -111,7 +137,7 @@ class SemiControlledCorrectLag:
     def load(self, scd: SemiControlledData):
         self.scd = scd
 
-    def correct_alignment(self, min_lag, max_lag, show=False):
+    def prepare_signals(self):
         # prepare neural signal
         neural_sig = self.scd.neural.iff
         neural_sig = smooth_scd_signal(neural_sig, self.scd)
@@ -133,13 +159,14 @@ class SemiControlledCorrectLag:
             contact_sig = smooth_scd_signal(contact_sig, self.scd)
             contact_sig = normalize_signal(contact_sig)
 
-        correlation, lags = self.compute_cross_correlation(neural_sig, contact_sig)
-        best_lag = self.find_best_lag(correlation, lags, min_lag, max_lag)
+        return neural_sig, contact_sig
 
-        # narrow down the results based on the parameters lag's min and max
-        window = range(np.where(lags == min_lag)[0][0], np.where(lags == max_lag)[0][0])
-        correlation_window = correlation[window]
-        lags_window = lags[window]
+    def correct_alignment(self, min_lag, max_lag, show=False):
+        neural_sig, contact_sig = self.prepare_signals()
+
+        # the correlation is only computed for the lags between min_lag and max_lag
+        correlation_window, lags_window = self.compute_cross_correlation(neural_sig, contact_sig, min_lag, max_lag)
+        best_lag = self.find_best_lag(correlation_window, lags_window, min_lag, max_lag)
 
         # normalise the correlation_window
         correlation_window = normalize_signal(correlation_window)
@@ -181,6 +208,33 @@ class SemiControlledCorrectLag:
         return correlation_window, best_lag
 
 
+def rows_range(matrix):
+    # (min, max) of each row of a 2D array ignoring NaN values, NaN for the rows with only NaN values
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        min_val = np.nanmin(matrix, axis=1, keepdims=True)
+        max_val = np.nanmax(matrix, axis=1, keepdims=True)
+    return min_val, max_val
+
+
+def rows_with_range(matrix):
+    # mask of the rows of a 2D array that are not constant (nor only NaN values)
+    min_val, max_val = rows_range(matrix)
+    value_range = (max_val - min_val)[:, 0]
+    return np.isfinite(value_range) & (value_range > 0)
+
+
+def normalize_rows(matrix):
+    # normalize_signal applied to each row of a 2D array, the rows without range are set to 0
+    # (a constant row would be divided by zero)
+    matrix = np.asarray(matrix, dtype=np.float64)
+    min_val, max_val = rows_range(matrix)
+    normalized = np.zeros_like(matrix)
+    valid_rows = rows_with_range(matrix)
+    normalized[valid_rows] = (matrix[valid_rows] - min_val[valid_rows]) / (max_val[valid_rows] - min_val[valid_rows])
+    return normalized
+
+
 def oversample_matrix(matrix, target_size):
     if not isinstance(matrix, np.ndarray):
         matrix = np.array(matrix)
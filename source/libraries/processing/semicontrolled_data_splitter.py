@@ -1,3 +1,4 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import copy
 from itertools import groupby
 from operator import itemgetter
@@ -29,7 +30,9 @@ class SemiControlledDataSplitter:
         self.save_visualiser_fname = save_visualiser_fname
 
     # add the kinect data into the dataframe
-    def merge_data(self, df_list, data_led_list, verbose=False):
+    # n_workers > 1 resamples the blocks in parallel with a pool of threads or of processes (pool="thread"/"process"),
+    # the output keeps the order of the input blocks
+    def merge_data(self, df_list, data_led_list, verbose=False, n_workers=1, pool="thread"):
         df_out = []
 
         # if not a list of dataframe, transform the variable into a list
@@ -37,17 +40,35 @@ class SemiControlledDataSplitter:
             df_list = [df_list]
             data_led_list = [data_led_list]
 
+        dataframe_times = [df["t"].values for df in df_list]
+        if verbose:
+            for dataframe_time in dataframe_times:
+                t = f"SemiControlledDataSplitter> CSVFILE: Number of sample of the current block = {len(dataframe_time)}"
+                print(t)
+
+        # resample the kinect data obj to the dataframe
+        if n_workers is not None and n_workers <= 1:
+            data_led_resampled = list(map(resample_kinect_led, data_led_list, dataframe_times))
+        else:
+            if pool == "thread":
+                executor_class = ThreadPoolExecutor
+            elif pool == "process":
+                executor_class = ProcessPoolExecutor
+            else:
+                raise ValueError(f"Unknown pool: {pool} (expected 'thread' or 'process').")
+            with executor_class(max_workers=n_workers) as executor:
+                # map keeps the order of the blocks
+                data_led_resampled = list(executor.map(resample_kinect_led, data_led_list, dataframe_times))
+
         # https://stackoverflow.com/questions/20625582/how-to-deal-with-settingwithcopywarning-in-pandas
         with pd.option_context('mode.chained_assignment', None):
             for idx, df in enumerate(df_list):
-                dataframe_time = df["t"].values
-                if verbose:
-                    t = f"SemiControlledDataSplitter> CSVFILE: Number of sample of the current block = {len(dataframe_time)}"
-                    print(t)
-
-                # resample the kinect data obj to the dataframe
                 kinect_led_curr = data_led_list[idx]
-                kinect_led_curr.resample(dataframe_time, show=False)
+                if data_led_resampled[idx] is not kinect_led_curr:
+                    # resampled by another process: update the object of the caller
+                    kinect_led_curr.time = data_led_resampled[idx].time
+                    kinect_led_curr.led_on = data_led_resampled[idx].led_on
+                    kinect_led_curr.green_levels = data_led_resampled[idx].green_levels
 
                 # add the kinect data into the dataframe
                 df['led_on'] = kinect_led_curr.led_on
@@ -388,11 +409,7 @@ class SemiControlledDataSplitter:
         return scd_list, endpoints_list
 
 
-
-
-
-
-
-
-
-
+def resample_kinect_led(kinect_led, dataframe_time):
+    # module level function so that it can be sent to a pool of processes
+    kinect_led.resample(dataframe_time, show=False)
+    return kinect_led
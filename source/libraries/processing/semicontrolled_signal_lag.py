@@ -0,0 +1,133 @@
+import numpy as np
+from scipy import fft
+
+
+def cross_correlation_fft(sig1, sig2):
+    # Full cross-correlation of two real signals computed with FFT (same values and lags as
+    # scipy.signal.correlate(sig1, sig2, mode="full") and scipy.signal.correlation_lags).
+    sig1 = np.asarray(sig1, dtype=np.float64)
+    sig2 = np.asarray(sig2, dtype=np.float64)
+    n1, n2 = len(sig1), len(sig2)
+    nfft = fft.next_fast_len(n1 + n2 - 1, real=True)
+    circular = fft.irfft(fft.rfft(sig1, nfft) * np.conj(fft.rfft(sig2, nfft)), nfft)
+    # the negative lags are located at the end of the circular correlation
+    correlation = np.concatenate((circular[nfft - n2 + 1:], circular[:n1]))
+    lags = np.arange(-(n2 - 1), n1)
+    return correlation, lags
+
+
+def cross_correlation_bounded(sig1, sig2, lags):
+    # Cross-correlation for the given lags only (direct dot products of the overlapping parts),
+    # with the same convention as cross_correlation_fft: correlation[lag] = sum_n sig1[n + lag] * sig2[n]
+    sig1 = np.asarray(sig1, dtype=np.float64)
+    sig2 = np.asarray(sig2, dtype=np.float64)
+    correlation = np.zeros(len(lags))
+    for idx, lag in enumerate(lags):
+        if lag >= 0:
+            n = min(len(sig1) - lag, len(sig2))
+            if n > 0:
+                correlation[idx] = np.dot(sig1[lag:lag + n], sig2[:n])
+        else:
+            n = min(len(sig1), len(sig2) + lag)
+            if n > 0:
+                correlation[idx] = np.dot(sig1[:n], sig2[-lag:-lag + n])
+    return correlation
+
+
+def cross_correlation_window_batch(sigs1, sigs2, min_lag, max_lag, batch_size=64):
+    # Cross-correlations of several pairs of signals (e.g. one pair per trial) for the lags min_lag..max_lag only,
+    # returned as a 2D array (npairs, nlags) with the convention of cross_correlation_bounded.
+    # The signals are zero-padded to the same length and correlated by batches with one FFT per batch, just long
+    # enough for the requested lags not to wrap around (length + max |lag| instead of twice the length).
+    lags = np.arange(min_lag, max_lag + 1)
+    correlations = np.zeros((len(sigs1), len(lags)))
+    if not len(sigs1):
+        return correlations, lags
+    max_len = max(max(len(sig) for sig in sigs1), max(len(sig) for sig in sigs2))
+    nfft = fft.next_fast_len(max_len + max(abs(min_lag), abs(max_lag)), real=True)
+    # the negative lags are located at the end of the circular correlation
+    lags_idx = np.mod(lags, nfft)
+    for start in range(0, len(sigs1), batch_size):
+        stop = min(start + batch_size, len(sigs1))
+        batch1 = np.zeros((stop - start, max_len))
+        batch2 = np.zeros((stop - start, max_len))
+        for row, idx in enumerate(range(start, stop)):
+            batch1[row, :len(sigs1[idx])] = sigs1[idx]
+            batch2[row, :len(sigs2[idx])] = sigs2[idx]
+        circular = fft.irfft(fft.rfft(batch1, nfft, axis=1) * np.conj(fft.rfft(batch2, nfft, axis=1)), nfft, axis=1)
+        correlations[start:stop] = circular[:, lags_idx]
+    return correlations, lags
+
+
+def refine_peak_parabolic(correlation, peak_idx):
+    # Sub-sample position of the peak: vertex of the parabola going through the peak and its two neighbours
+    if peak_idx <= 0 or peak_idx >= len(correlation) - 1:
+        return 0.0
+    y_prev, y_peak, y_next = correlation[peak_idx - 1:peak_idx + 2]
+    denominator = y_prev - 2 * y_peak + y_next
+    if denominator == 0:
+        return 0.0
+    return 0.5 * (y_prev - y_next) / denominator
+
+
+def block_average(sig, factor):
+    # Decimation by averaging blocks of factor samples (a short pulse still contributes, unlike index picking)
+    n = len(sig) // factor * factor
+    averaged = sig[:n].reshape(-1, factor).mean(axis=1)
+    if n < len(sig):
+        averaged = np.append(averaged, sig[n:].mean())
+    return averaged
+
+
+def zero_mean_without_nan(sig):
+    # copy of the signal with NaN values set to 0, then the mean removed (better estimation of the correlation)
+    sig = np.array(sig, dtype=np.float64)
+    sig[np.isnan(sig)] = 0
+    sig -= np.mean(sig)
+    return sig
+
+
+def search_local_peak(sig1, sig2, lag_start, half_width=3):
+    # Full rate cross-correlation around lag_start, the window is extended until the maximum
+    # is not on its border anymore (the neighbours of the peak are needed for the parabolic refinement)
+    lag_min = max(lag_start - half_width, -(len(sig2) - 1))
+    lag_max = min(lag_start + half_width, len(sig1) - 1)
+    lags = np.arange(lag_min, lag_max + 1)
+    correlation = cross_correlation_bounded(sig1, sig2, lags)
+    while True:
+        peak_idx = int(np.argmax(correlation))
+        if peak_idx == 0 and lags[0] > -(len(sig2) - 1):
+            lags_new = np.arange(max(lags[0] - half_width, -(len(sig2) - 1)), lags[0])
+            correlation = np.concatenate((cross_correlation_bounded(sig1, sig2, lags_new), correlation))
+            lags = np.concatenate((lags_new, lags))
+        elif peak_idx == len(lags) - 1 and lags[-1] < len(sig1) - 1:
+            lags_new = np.arange(lags[-1] + 1, min(lags[-1] + half_width, len(sig1) - 1) + 1)
+            correlation = np.concatenate((correlation, cross_correlation_bounded(sig1, sig2, lags_new)))
+            lags = np.concatenate((lags, lags_new))
+        else:
+            return correlation, lags
+
+
+def estimate_lag(sig1, sig2, subsample=True, coarse_factor=None):
+    # Lag (in samples) that maximises the cross-correlation of the two signals, NaN values count as 0.
+    # A positive lag means that sig2 has to be delayed by lag samples to match sig1.
+    #   - subsample: the integer lag is refined with a parabolic fit of the correlation peak (float output),
+    #   - coarse_factor: the lag is first searched on signals block-averaged by coarse_factor,
+    #     then refined at full rate around the coarse estimation only (local maximum of the correlation).
+    sig1 = zero_mean_without_nan(sig1)
+    sig2 = zero_mean_without_nan(sig2)
+
+    if coarse_factor is not None and coarse_factor > 1:
+        correlation, lags = cross_correlation_fft(block_average(sig1, coarse_factor),
+                                                  block_average(sig2, coarse_factor))
+        peak_idx = int(np.argmax(correlation))
+        lag_coarse = (lags[peak_idx] + refine_peak_parabolic(correlation, peak_idx)) * coarse_factor
+        correlation, lags = search_local_peak(sig1, sig2, int(np.round(lag_coarse)))
+    else:
+        correlation, lags = cross_correlation_fft(sig1, sig2)
+
+    peak_idx = int(np.argmax(correlation))
+    lag = int(lags[peak_idx])
+    if not subsample:
+        return lag
+    return lag + refine_peak_parabolic(correlation, peak_idx)